@@ -0,0 +1,46 @@
+"""
+© 2022. Triad National Security, LLC. All rights reserved.
+This program was produced under U.S. Government contract 89233218CNA000001 for Los Alamos
+National Laboratory (LANL), which is operated by Triad National Security, LLC for the U.S.
+Department of Energy/National Nuclear Security Administration. All rights in the program are
+reserved by Triad National Security, LLC, and the U.S. Department of Energy/National Nuclear
+Security Administration. The Government is granted for itself and others acting on its behalf a
+nonexclusive, paid-up, irrevocable worldwide license in this material to reproduce, prepare
+derivative works, distribute copies to the public, perform publicly and display publicly, and to permit
+others to do so.
+"""
+
+
+import sys
+sys.path.append("../")
+from create_telecloning_circuits import *
+import argparse
+
+''' Benchmark of the MPS simulation against the statevector, for the 'LNN' deferred measurement circuits A^(m-1) P C^m
+	- MPS: mps_clone_operators (TCstate and LOCC gates), with bond dimension max_bond (None: exact up to the cutoff)
+	- statevector: clone_state_operators (closed form TCstate, LOCC gates), up to m = --statevector-limit
+	- prints the run times, the largest bond dimension, the truncation error and the largest deviation of the clone
+	  state operators between both
+	usage: python benchmark_MPS.py 2 4 6 8 10 12 --max-bond 16
+'''
+def benchmark(m, max_bond=None, statevector_limit=9):
+	variant = TCvariant(m, True, 'LNN', 'dfm')
+	t0 = time.time()
+	R, error, bond = mps_clone_operators(variant, max_bond)
+	t_mps = time.time()-t0
+	line = "m={:3d} qubits={:3d} MPS {:8.2f}s bond {:4d} truncation error {:.1e}".format(m, 2*m+1, t_mps, bond, error)
+	if (m <= statevector_limit):
+		t0 = time.time()
+		R_statevector = clone_state_operators(variant)
+		line += " | statevector {:8.2f}s deviation {:.1e}".format(time.time()-t0, numpy.abs(R - R_statevector).max())
+	print(line)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='MPS versus statevector simulation of the LNN telecloning circuits')
+	parser.add_argument('m', type=int, nargs='*', default=[2, 4, 6, 8, 10, 12], help='numbers of clones')
+	parser.add_argument('--max-bond', type=int, default=None, help='maximal MPS bond dimension (default: no limit)')
+	parser.add_argument('--statevector-limit', type=int, default=9, help='largest m simulated with the statevector')
+	args = parser.parse_args()
+	for m in args.m:
+		benchmark(m, args.max_bond, args.statevector_limit)
@@ -24,10 +24,14 @@ backend = Aer.get_backend('qasm_simulator')
 
 N_shots = 30000
 
+# feed-forward as deferred measurement (controlled gates, measurements of message and port into the same classical bits
+# at the end): same counts, sampled from one final state instead of branching per shot on the c_if corrections
+DEFERRED = True
+
 def run(angle_ry, angle_rz):
 	print("Ry angle =", angle_ry)
 	print("Rz angle =", angle_rz)
-	qc_tc_original, clone_indices, rho = construct_PCCC_Honeywell_QASM_circuit_Qiskit_version(angle_ry, angle_rz, True)
+	qc_tc_original, clone_indices, rho = construct_variant_circuit("PCCC_Honeywell_QASM_circuit_Qiskit_version", angle_ry, angle_rz, deferred=DEFERRED)
 	qc_tc = copy.deepcopy(qc_tc_original)
 	
 	tomography_circuits = parallel_qubit_state_tomography_general(clone_indices, copy.deepcopy(qc_tc), angle_ry, angle_rz)
@@ -14,6 +14,7 @@ import sys
 sys.path.append("../")
 from utils import *
 from create_telecloning_circuits import *
+from simulate_sweep import simulate_sweep
 from qiskit import *
 import numpy as np
 from qiskit.ignis.verification.tomography import StateTomographyFitter
@@ -22,27 +23,42 @@ import copy
 
 backend = Aer.get_backend('qasm_simulator')
 
+# matrix product state simulation with bounded bond dimension (None: default method), see benchmark_MPS.py
+MPS_MAX_BOND = None
+if MPS_MAX_BOND is not None:
+	backend.set_options(method='matrix_product_state', matrix_product_state_max_bond_dimension=MPS_MAX_BOND, mps_log_data=True)
+
 N_shots = 30000
 
+# sweep mode: all message states at once, 'auto' with the fastest engine for the grid (see simulate_sweep.py),
+# 'aer' in a single Aer job with parameter_binds (see run_tomography_sweep), 'shared_prefix' with one statevector
+# simulation per message state for all tomography bases (see shared_prefix_tomography_sweep), None: one Aer job per message state (used with MPS_MAX_BOND)
+SWEEP = 'auto' if MPS_MAX_BOND is None else None
+
 def run(angle_ry, angle_rz):
 	print("Ry angle =", angle_ry)
 	print("Rz angle =", angle_rz)
 	qc_tc_original, clone_indices, rho = construct_deferred_measurement_PCC(angle_ry, angle_rz)
-	qc_tc = copy.deepcopy(qc_tc_original)
 	
-	tomography_circuits = parallel_qubit_state_tomography_general(clone_indices, copy.deepcopy(qc_tc), angle_ry, angle_rz)
-	job = backend.run(tomography_circuits, shots=N_shots)
-	result = job.result()
+	if SWEEP:
+		get_counts = sweep_counts.__getitem__
+	else:
+		tomography_circuits = parallel_qubit_state_tomography_general(clone_indices, copy.deepcopy(qc_tc_original), angle_ry, angle_rz)
+		job = backend.run(tomography_circuits, shots=N_shots)
+		result = job.result()
+		if MPS_MAX_BOND is not None:
+			print("MPS bond dimensions:", result.results[0].metadata.get('MPS_log_data'))
+		get_counts = result.get_counts
 	
-	counts = result.get_counts("Y_"+str(angle_ry)+"_"+str(angle_rz))
+	counts = get_counts("Y_"+str(angle_ry)+"_"+str(angle_rz))
 	counts_clone1_Y = get_single_qubit_measurements_from_parallel_results(counts, clone_indices[0])
 	counts_clone2_Y = get_single_qubit_measurements_from_parallel_results(counts, clone_indices[1])
 	
-	counts = result.get_counts("X_"+str(angle_ry)+"_"+str(angle_rz))
+	counts = get_counts("X_"+str(angle_ry)+"_"+str(angle_rz))
 	counts_clone1_X = get_single_qubit_measurements_from_parallel_results(counts, clone_indices[0])
 	counts_clone2_X = get_single_qubit_measurements_from_parallel_results(counts, clone_indices[1])
 	
-	counts = result.get_counts("Z_"+str(angle_ry)+"_"+str(angle_rz))
+	counts = get_counts("Z_"+str(angle_ry)+"_"+str(angle_rz))
 	counts_clone1_Z = get_single_qubit_measurements_from_parallel_results(counts, clone_indices[0])
 	counts_clone2_Z = get_single_qubit_measurements_from_parallel_results(counts, clone_indices[1])
 	
@@ -63,6 +79,9 @@ def run(angle_ry, angle_rz):
 
 
 angles = np.linspace(0, 2*math.pi, num=100)
+if SWEEP:
+	sweep = {'auto': lambda *args: simulate_sweep(*args, backend=backend)[0], 'aer': lambda *args: run_tomography_sweep(backend, *args), 'shared_prefix': shared_prefix_tomography_sweep}[SWEEP]
+	sweep_counts = tomography_counts_by_name(sweep("deferred_measurement_PCC", angles[:, None], angles[None, :], N_shots), angles[:, None], angles[None, :])
 
 for angle in angles:
 	for angle2 in angles:
@@ -14,6 +14,7 @@ import sys
 sys.path.append("../")
 from utils import *
 from create_telecloning_circuits import *
+from simulate_sweep import simulate_sweep
 from qiskit import *
 import numpy as np
 from qiskit.ignis.verification.tomography import StateTomographyFitter
@@ -24,6 +25,11 @@ backend = Aer.get_backend('qasm_simulator')
 
 N_shots = 30000
 
+# sweep mode: all message states at once, 'auto' with the fastest engine for the grid (see simulate_sweep.py),
+# 'aer' in a single Aer job with parameter_binds (see run_tomography_sweep), 'shared_prefix' with one statevector
+# simulation per message state for all tomography bases (see shared_prefix_tomography_sweep), None: one Aer job per message state
+SWEEP = 'auto'
+
 def run(angle_ry, angle_rz):
 	print("Ry angle =", angle_ry)
 	print("Rz angle =", angle_rz)
@@ -39,25 +45,20 @@ def run(angle_ry, angle_rz):
 	Y_counts_clone3 = {"0": 0, "1": 0}
 	Z_counts_clone3 = {"0": 0, "1": 0}
 	classical_post_selected_states = ["00", "11", "01", "10"]
+	rho = message_density_matrix(angle_ry, angle_rz)
 	for classical_state in classical_post_selected_states:
-		if classical_state == "11":
-			qc_tc_original, clone_indices, rho, post_select_indices = construct_PCCC_postselect_11(angle_ry, angle_rz)
-		elif classical_state == "10":
-			qc_tc_original, clone_indices, rho, post_select_indices = construct_PCCC_postselect_10(angle_ry, angle_rz)
-		elif classical_state == "01":
-			qc_tc_original, clone_indices, rho, post_select_indices = construct_PCCC_postselect_01(angle_ry, angle_rz)
-		elif classical_state == "00":
-			qc_tc_original, clone_indices, rho, post_select_indices = construct_PCCC_postselect_00(angle_ry, angle_rz)
+		metadata = variant_metadata("PCCC_postselect_"+classical_state)
+		clone_indices, post_select_indices = metadata['clone_indices'], metadata['post_select_indices']
+		if SWEEP:
+			get_counts = sweep_counts[classical_state].__getitem__
 		else:
-			print("Error encountered, exiting")
-			sys.exit()
-		tomography_circuits = parallel_qubit_state_tomography_general(clone_indices, copy.deepcopy(qc_tc_original), angle_ry, angle_rz)
-		
-		tomography_circuits = add_measurements_for_postselect_circuits_for_tomography_circuits(copy.deepcopy(tomography_circuits), post_select_indices)
-		job = backend.run(tomography_circuits, shots=N_shots)
-		result = job.result()
+			qc_tc_original = construct_variant_circuit("PCCC_postselect_"+classical_state, angle_ry, angle_rz)[0]
+			tomography_circuits = parallel_qubit_state_tomography_general(clone_indices, copy.deepcopy(qc_tc_original), angle_ry, angle_rz)
+			tomography_circuits = add_measurements_for_postselect_circuits_for_tomography_circuits(copy.deepcopy(tomography_circuits), post_select_indices)
+			job = backend.run(tomography_circuits, shots=N_shots)
+			get_counts = job.result().get_counts
 		
-		counts = result.get_counts("Y_"+str(angle_ry)+"_"+str(angle_rz))
+		counts = get_counts("Y_"+str(angle_ry)+"_"+str(angle_rz))
 		c_1_Y = get_single_qubit_measurements_from_parallel_results_with_postselection(counts, clone_indices[0], post_select_indices)
 		c_2_Y = get_single_qubit_measurements_from_parallel_results_with_postselection(counts, clone_indices[1], post_select_indices)
 		c_3_Y = get_single_qubit_measurements_from_parallel_results_with_postselection(counts, clone_indices[2], post_select_indices)
@@ -65,7 +66,7 @@ def run(angle_ry, angle_rz):
 		Y_counts_clone2 = merge_dictionaries(c_2_Y, Y_counts_clone2)
 		Y_counts_clone3 = merge_dictionaries(c_3_Y, Y_counts_clone3)
 		
-		counts = result.get_counts("X_"+str(angle_ry)+"_"+str(angle_rz))
+		counts = get_counts("X_"+str(angle_ry)+"_"+str(angle_rz))
 		c_1_X = get_single_qubit_measurements_from_parallel_results_with_postselection(counts, clone_indices[0], post_select_indices)
 		c_2_X = get_single_qubit_measurements_from_parallel_results_with_postselection(counts, clone_indices[1], post_select_indices)
 		c_3_X = get_single_qubit_measurements_from_parallel_results_with_postselection(counts, clone_indices[2], post_select_indices)
@@ -73,7 +74,7 @@ def run(angle_ry, angle_rz):
 		X_counts_clone2 = merge_dictionaries(c_2_X, X_counts_clone2)
 		X_counts_clone3 = merge_dictionaries(c_3_X, X_counts_clone3)
 		
-		counts = result.get_counts("Z_"+str(angle_ry)+"_"+str(angle_rz))
+		counts = get_counts("Z_"+str(angle_ry)+"_"+str(angle_rz))
 		c_1_Z = get_single_qubit_measurements_from_parallel_results_with_postselection(counts, clone_indices[0], post_select_indices)
 		c_2_Z = get_single_qubit_measurements_from_parallel_results_with_postselection(counts, clone_indices[1], post_select_indices)
 		c_3_Z = get_single_qubit_measurements_from_parallel_results_with_postselection(counts, clone_indices[2], post_select_indices)
@@ -104,6 +105,9 @@ def run(angle_ry, angle_rz):
 	print("Clone 3 fidelity:", Fidelity_clone3)
 
 angles = np.linspace(0, 2*math.pi, num=100)
+if SWEEP:
+	sweep = {'auto': lambda *args: simulate_sweep(*args, backend=backend)[0], 'aer': lambda *args: run_tomography_sweep(backend, *args), 'shared_prefix': shared_prefix_tomography_sweep}[SWEEP]
+	sweep_counts = {classical_state: tomography_counts_by_name(sweep("PCCC_postselect_"+classical_state, angles[:, None], angles[None, :], N_shots), angles[:, None], angles[None, :]) for classical_state in ["00", "11", "01", "10"]}
 
 for angle in angles:
 	for angle2 in angles:
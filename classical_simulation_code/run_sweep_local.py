@@ -0,0 +1,166 @@
+"""
+© 2022. Triad National Security, LLC. All rights reserved.
+This program was produced under U.S. Government contract 89233218CNA000001 for Los Alamos
+National Laboratory (LANL), which is operated by Triad National Security, LLC for the U.S.
+Department of Energy/National Nuclear Security Administration. All rights in the program are
+reserved by Triad National Security, LLC, and the U.S. Department of Energy/National Nuclear
+Security Administration. The Government is granted for itself and others acting on its behalf a
+nonexclusive, paid-up, irrevocable worldwide license in this material to reproduce, prepare
+derivative works, distribute copies to the public, perform publicly and display publicly, and to permit
+others to do so.
+"""
+
+import sys
+sys.path.append("../")
+from create_telecloning_circuits import *
+from simulate_sweep import simulate_sweep, choose_simulation_method
+from noisy_simulation import load_calibration
+from qiskit import Aer
+from multiprocessing import Pool, shared_memory
+import argparse
+import os
+
+''' Parallel message angle sweep, in place of the run_postselect_local_*, run_deferred_measurement_local_* and
+	run_classical_feed_forward_Qiskit_local_* scripts (one per layout and LOCC mode, serial over the grid)
+	- layout: 'PCC', 'APCC', 'PCCC', 'AAPCCC', ... (A^(m-1) P C^m with ancillas, P C^m without)
+	- locc: 'dfm' (deferred measurement), 'locc' (feed-forward), 'postselect' (the four outcomes ps00, ps11, ps01, ps10
+	  merged, as run_postselect_local_*) or a single 'psXZ'; topology as in VARIANTS ('full' for 'locc', else 'LNN')
+	- the grid is cut into chunks of message states, which a process pool simulates with the engine chosen once by
+	  choose_simulation_method for the chunk size (see simulate_sweep.py); shots=0 gives the exact clone states instead
+	  of tomography counts, which are fitted by linear inversion (tomography_marginals, tomography_clone_states)
+	- the workers write clone states, fidelities and postselection probabilities straight into shared memory arrays, only
+	  chunk bounds are sent between processes; Aer runs single-threaded per worker
+	- probabilities: one per variant (last axis, in the order of sweep_variants: ps00, ps11, ps01, ps10 for 'postselect'),
+	  the probability of the postselected outcome (1 for 'dfm' and 'locc'), estimated from the Z basis shots with shots > 0
+	- check_sweep / --check: compares the probabilities of a sweep with those of exact_clone_states, exit code 1 if they
+	  deviate by more than 1e-9 (shots=0) or 2.5/sqrt(shots), i.e. five standard deviations
+	- seed: an integer or numpy.random.SeedSequence, from which every chunk and variant gets its own seed (spawn key
+	  (chunk start, variant)), so the counts are reproducible for the same number of workers
+	- properties / --calibration: device noise model of a calibration snapshot, with the variant qubits on initial_layout
+	- output: npz with the angle grids, the arrays of shape (ry, rz, ...) and a json 'metadata' string
+	usage: python run_sweep_local.py APCC --locc postselect --ry 0 6.283185307179586 100 --shots 30000 --workers 64 --output APCC_postselect.npz
+	       python run_sweep_local.py APCC --locc postselect --ry 0 3.14 5 --rz 0 6.28 5 --shots 30000 --workers 2 --check
+'''
+_SHARED = {}
+
+def sweep_variants(layout, locc, topology=None):
+	m = layout.count('C')
+	ancilla = layout.startswith('A')
+	if (m < 2 or layout != 'A'*(m-1)*ancilla + 'P' + 'C'*m):
+		raise ValueError("layout must be A^(m-1) P C^m or P C^m, got '{}'".format(layout))
+	topology = ('full' if (locc == 'locc') else 'LNN') if topology is None else topology
+	loccs = ['ps00', 'ps11', 'ps01', 'ps10'] if (locc == 'postselect') else [locc]
+	return [TCvariant(m, ancilla, topology, l) for l in loccs]
+
+def _attach(names, shapes, dtypes, grid, variants, shots, method, seed, threads, properties=None, initial_layout=None):
+	for key in names:
+		shm = shared_memory.SharedMemory(name=names[key])
+		_SHARED[key] = (shm, numpy.ndarray(shapes[key], dtype=dtypes[key], buffer=shm.buf))
+	backend = None
+	if method.startswith('aer'):
+		backend = Aer.get_backend('qasm_simulator')
+		if threads is not None:
+			backend.set_options(max_parallel_threads=threads)
+	_SHARED['config'] = (grid, variants, shots, method, seed, backend, properties, initial_layout)
+
+def _run_chunk(bounds):
+	start, stop = bounds
+	(ry, rz), variants, shots, method, seed, backend, properties, initial_layout = _SHARED['config']
+	i, j = numpy.divmod(numpy.arange(start, stop), len(rz))
+	ryangles, rzangles = ry[i], rz[j]
+	rhos, marginals = 0, 0
+	probabilities = numpy.zeros((stop-start, len(variants)))
+	for v, variant in enumerate(variants):
+		chunk_seed = None if seed is None else int(numpy.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (start, v)).generate_state(1, numpy.uint64)[0] >> 1)
+		results, _ = simulate_sweep(variant, ryangles, rzangles, shots or None, properties, initial_layout, method, seed=chunk_seed, backend=backend, log=None)
+		if shots:
+			metadata = variant_metadata(variant)
+			variant_marginals = tomography_marginals(results, metadata['clone_indices'], metadata['post_select_indices'])
+			marginals = marginals + variant_marginals
+			# postselected shots of the Z basis circuit
+			probabilities[:, v] = variant_marginals[:, 0, 2].sum(axis=-1)/shots
+		else:
+			rhos = rhos + results[0]*results[2][:, None, None, None]
+			probabilities[:, v] = results[2]
+	if shots:
+		rhos = tomography_clone_states(marginals)
+	else:
+		rhos = rhos/probabilities.sum(axis=1)[:, None, None, None]
+	psi = message_statevectors(ryangles, rzangles)
+	_SHARED['rhos'][1][start:stop] = rhos
+	_SHARED['fidelities'][1][start:stop] = numpy.real(numpy.einsum('ni,nkij,nj->nk', psi.conj(), rhos, psi))
+	_SHARED['probabilities'][1][start:stop] = probabilities
+	return stop-start
+
+def run_sweep(variants, ry, rz, shots, workers, method='auto', seed=None, properties=None, initial_layout=None, chunks_per_worker=4):
+	m = variants[0].m
+	N = len(ry)*len(rz)
+	seed = numpy.random.SeedSequence(seed) if (seed is not None and not isinstance(seed, numpy.random.SeedSequence)) else seed
+	chunk = max(1, -(-N//(workers*chunks_per_worker)))
+	if (method == 'auto'):
+		method, costs = choose_simulation_method(variants[0], chunk, shots or None, properties)
+		print("run_sweep_local: {} message states in chunks of {} on {} workers, {} (predicted {:.3g}s per chunk and variant)".format(N, chunk, workers, method, costs[method]))
+	shapes = {'rhos': (N, m, 2, 2), 'fidelities': (N, m), 'probabilities': (N, len(variants))}
+	dtypes = {'rhos': complex, 'fidelities': float, 'probabilities': float}
+	segments = {key: shared_memory.SharedMemory(create=True, size=max(1, int(numpy.prod(shapes[key]))*numpy.dtype(dtypes[key]).itemsize)) for key in shapes}
+	try:
+		initargs = ({key: segment.name for key, segment in segments.items()}, shapes, dtypes, (ry, rz), variants, shots, method, seed, 1 if (workers > 1) else None, properties, initial_layout)
+		bounds = [(start, min(start+chunk, N)) for start in range(0, N, chunk)]
+		if (workers > 1):
+			with Pool(workers, initializer=_attach, initargs=initargs) as pool:
+				for _ in pool.imap_unordered(_run_chunk, bounds):
+					pass
+		else:
+			_attach(*initargs)
+			for b in bounds:
+				_run_chunk(b)
+		results = {key: numpy.ndarray(shapes[key], dtype=dtypes[key], buffer=segments[key].buf).reshape((len(ry), len(rz)) + shapes[key][1:]).copy() for key in shapes}
+	finally:
+		_SHARED.clear()
+		for segment in segments.values():
+			segment.close()
+			segment.unlink()
+	return results, method
+
+def check_sweep(variants, ry, rz, shots, workers, method='auto', seed=None):
+	results, _ = run_sweep(variants, ry, rz, shots, workers, method, seed)
+	exact = numpy.stack([exact_clone_states(variant, ry[:, None], rz[None, :])[2].reshape(len(ry), len(rz)) for variant in variants], axis=-1)
+	return float(numpy.abs(results['probabilities'] - exact).max())
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='parallel sweep of telecloning clone fidelities over a grid of message states')
+	parser.add_argument('layout', help="qubit layout, e.g. 'PCC', 'APCC', 'PCCC', 'AAPCCC'")
+	parser.add_argument('--locc', default='dfm', choices=['dfm', 'locc', 'postselect', 'ps00', 'ps01', 'ps10', 'ps11'])
+	parser.add_argument('--topology', default=None, help="'LNN' or 'full' (default: 'full' for 'locc', else 'LNN')")
+	parser.add_argument('--ry', type=float, nargs=3, default=[0, 2*math.pi, 100], metavar=('START', 'STOP', 'NUM'), help='Ry angle grid (numpy.linspace)')
+	parser.add_argument('--rz', type=float, nargs=3, default=[0, 2*math.pi, 100], metavar=('START', 'STOP', 'NUM'), help='Rz angle grid (numpy.linspace)')
+	parser.add_argument('--shots', type=int, default=30000, help='tomography shots per circuit, 0 for the exact clone states')
+	parser.add_argument('--workers', type=int, default=os.cpu_count())
+	parser.add_argument('--method', default='auto', help='simulation method, see simulate_sweep.py')
+	parser.add_argument('--seed', type=int, default=None)
+	parser.add_argument('--calibration', default=None, help='calibration snapshot (json) for a device noise model, see save_calibration')
+	parser.add_argument('--initial-layout', type=int, nargs='+', default=None, help='physical qubits of the variant qubits (with --calibration)')
+	parser.add_argument('--output', default=None, help='npz file for the angle grids, clone states, fidelities and probabilities')
+	parser.add_argument('--check', action='store_true', help='compare the postselection probabilities with exact_clone_states instead')
+	args = parser.parse_args()
+	variants = sweep_variants(args.layout, args.locc, args.topology)
+	ry = numpy.linspace(args.ry[0], args.ry[1], num=int(args.ry[2]))
+	rz = numpy.linspace(args.rz[0], args.rz[1], num=int(args.rz[2]))
+	if args.check:
+		deviation = check_sweep(variants, ry, rz, args.shots, args.workers, args.method, args.seed)
+		tol = 2.5/math.sqrt(args.shots) if args.shots else 1e-9
+		print("postselection probabilities: largest deviation from exact_clone_states {:.2e} (tolerance {:.2e}) {}".format(deviation, tol, 'ok' if deviation <= tol else 'FAILED'))
+		sys.exit(0 if deviation <= tol else 1)
+	t0 = time.time()
+	properties = None if args.calibration is None else load_calibration(args.calibration)
+	results, method = run_sweep(variants, ry, rz, args.shots, args.workers, args.method, args.seed, properties, args.initial_layout)
+	elapsed = time.time()-t0
+	for k in range(variants[0].m):
+		fidelities = results['fidelities'][..., k]
+		print("clone {}: fidelity mean {:.4f} min {:.4f} max {:.4f}".format(k+1, fidelities.mean(), fidelities.min(), fidelities.max()))
+	print("{} message states with {} on {} workers in {:.2f}s".format(ry.size*rz.size, method, args.workers, elapsed))
+	if args.output is not None:
+		metadata = {'layout': args.layout, 'locc': args.locc, 'variants': [v._asdict() for v in variants], 'shots': args.shots, 'calibration': args.calibration, 'initial_layout': args.initial_layout,
+			'method': method, 'seed': args.seed, 'workers': args.workers, 'elapsed': elapsed}
+		numpy.savez(args.output, ryangles=ry, rzangles=rz, metadata=json.dumps(metadata), **results)
@@ -0,0 +1,271 @@
+"""
+© 2022. Triad National Security, LLC. All rights reserved.
+This program was produced under U.S. Government contract 89233218CNA000001 for Los Alamos
+National Laboratory (LANL), which is operated by Triad National Security, LLC for the U.S.
+Department of Energy/National Nuclear Security Administration. All rights in the program are
+reserved by Triad National Security, LLC, and the U.S. Department of Energy/National Nuclear
+Security Administration. The Government is granted for itself and others acting on its behalf a
+nonexclusive, paid-up, irrevocable worldwide license in this material to reproduce, prepare
+derivative works, distribute copies to the public, perform publicly and display publicly, and to permit
+others to do so.
+"""
+
+from run_sweep_local import *
+import itertools
+import threading
+import socket
+import zlib
+import tempfile
+import shutil
+
+''' Multi-node sweeps through a work queue on a shared filesystem (no broker), for sweeps over layouts, LOCC modes,
+	topologies and noise models
+	queue directory:
+	- spec.json: the sweep tasks (one run_sweep per layout, locc, topology, calibration) and their angle grids
+	- pending/lane_XX/<task>_<row>.json: shards of Ry rows, dealt round-robin onto one lane per expected node
+	- running/<shard>.json: claimed shards, the file mtime is the heartbeat of the owner
+	- done/<shard>.npz: shard results (run_sweep arrays), written to a temporary file and renamed
+	init_queue(path, tasks, ry, rz, shots, shard_rows, lanes, ...)
+	- writes spec.json and the pending shards
+	work(path, lane, workers, heartbeat=30, timeout=300, poll=10)
+	- claims a shard by os.rename from pending into running (atomic, only one node wins), first from its own lane in
+	  order, then by stealing the last shard of the fullest other lane, runs it with run_sweep on the local workers
+	  while a thread touches the running file every heartbeat seconds (first right at the claim), stores the result
+	  and releases the claim
+	- seeds: numpy.random.SeedSequence(seed) with spawn key (task, shard row), see run_sweep
+	- running shards whose heartbeat is older than timeout seconds (against the filesystem clock) go back to their
+	  lane; a result stored by a node that lost its claim is kept, shards with a result are not run again
+	- returns when nothing is pending or running
+	merge(path, output)
+	- assembles the shard results of every task into one npz per task (as run_sweep_local --output) in output,
+	  returns the names of the tasks with missing shards
+	check_queue()
+	- claim/reclaim checks on a small queue in a temporary directory: a fresh claim of a shard that waited in pending
+	  longer than the timeout is not reclaimed, a dead node's shard is reclaimed once, and two concurrent nodes run
+	  every shard exactly once; returns the failed checks
+	usage: python run_sweep_queue.py init  /shared/q --layouts PCC APCC --loccs dfm postselect --topologies LNN full --lanes 16
+	       python run_sweep_queue.py work  /shared/q --lane $SLURM_PROCID     (one per node)
+	       python run_sweep_queue.py merge /shared/q --output results/
+	       python run_sweep_queue.py check
+'''
+def init_queue(path, tasks, ry, rz, shots, shard_rows=1, lanes=1, method='auto', seed=None):
+	if os.path.exists(os.path.join(path, 'spec.json')):
+		raise ValueError("queue {} exists already".format(path))
+	for directory in ['running', 'done', 'clock'] + ['pending/lane_{:02d}'.format(lane) for lane in range(lanes)]:
+		os.makedirs(os.path.join(path, directory), exist_ok=True)
+	spec = {'tasks': tasks, 'ry': [float(angle) for angle in ry], 'rz': [float(angle) for angle in rz], 'shots': shots,
+		'method': method, 'seed': seed, 'lanes': lanes}
+	shards = [(t, start) for t in range(len(tasks)) for start in range(0, len(ry), shard_rows)]
+	for i, (t, start) in enumerate(shards):
+		shard = {'task': t, 'rows': [start, min(start+shard_rows, len(ry))], 'lane': i % lanes}
+		_write_json(os.path.join(path, 'pending', 'lane_{:02d}'.format(i % lanes), '{:04d}_{:06d}.json'.format(t, start)), shard)
+	_write_json(os.path.join(path, 'spec.json'), spec)
+	return len(shards)
+
+def queue_tasks(layouts, loccs, topologies=(None,), calibrations=(None,), initial_layout=None):
+	return [{'layout': layout, 'locc': locc, 'topology': topology, 'calibration': calibration, 'initial_layout': initial_layout}
+		for layout, locc, topology, calibration in itertools.product(layouts, loccs, topologies, calibrations)]
+
+# write to a temporary file next to the target and rename, so that readers never see partial files
+def _write_json(path, data):
+	tmp = "{}.{}.{}.tmp".format(path, socket.gethostname(), os.getpid())
+	with open(tmp, 'w') as file:
+		json.dump(data, file)
+	os.replace(tmp, path)
+
+def _read_json(path):
+	with open(path) as file:
+		return json.load(file)
+
+# the current time of the filesystem server, which sets the mtimes of the heartbeats (node clocks may be skewed)
+def _filesystem_now(path):
+	clock = os.path.join(path, 'clock', '{}.{}'.format(socket.gethostname(), os.getpid()))
+	with open(clock, 'w'):
+		pass
+	return os.stat(clock).st_mtime
+
+def _lane_shards(path):
+	pending = os.path.join(path, 'pending')
+	return {lane: sorted(name for name in os.listdir(os.path.join(pending, lane)) if name.endswith('.json')) for lane in sorted(os.listdir(pending))}
+
+def claim_shard(path, lane):
+	lanes = _lane_shards(path)
+	own = 'lane_{:02d}'.format(lane % len(lanes))
+	# own lane from the front, then steal from the back of the fullest other lane
+	candidates = [(own, name) for name in lanes[own]]
+	for other in sorted((l for l in lanes if l != own), key=lambda l: len(lanes[l]), reverse=True):
+		candidates += [(other, name) for name in lanes[other][::-1]]
+	for source, name in candidates:
+		running = os.path.join(path, 'running', name)
+		try:
+			os.rename(os.path.join(path, 'pending', source, name), running)
+			# the rename keeps the mtime of init, the first heartbeat has to come before any reclaim_shards sees it
+			os.utime(running)
+		except FileNotFoundError:
+			continue # claimed by another node (or reclaimed in between)
+		if os.path.exists(os.path.join(path, 'done', name[:-len('.json')] + '.npz')):
+			_remove(running)
+			continue
+		return name
+	return None
+
+def reclaim_shards(path, timeout):
+	now = _filesystem_now(path)
+	reclaimed = 0
+	for name in os.listdir(os.path.join(path, 'running')):
+		running = os.path.join(path, 'running', name)
+		try:
+			if (now - os.stat(running).st_mtime <= timeout):
+				continue
+			shard = _read_json(running)
+			os.rename(running, os.path.join(path, 'pending', 'lane_{:02d}'.format(shard['lane']), name))
+			reclaimed += 1
+		except FileNotFoundError:
+			continue # finished or reclaimed by another node meanwhile
+	return reclaimed
+
+def _remove(path):
+	try:
+		os.remove(path)
+	except FileNotFoundError:
+		pass
+
+def _heartbeat(running, interval, stop, lost):
+	while not stop.wait(interval):
+		try:
+			os.utime(running)
+		except FileNotFoundError:
+			lost.set() # reclaimed by another node, the result is still stored
+			return
+
+def run_shard(path, spec, name, workers):
+	shard = _read_json(os.path.join(path, 'running', name))
+	task = spec['tasks'][shard['task']]
+	start, stop = shard['rows']
+	variants = sweep_variants(task['layout'], task['locc'], task['topology'])
+	properties = None if task['calibration'] is None else load_calibration(task['calibration'])
+	seed = None if spec['seed'] is None else numpy.random.SeedSequence(spec['seed'], spawn_key=(shard['task'], start))
+	results, method = run_sweep(variants, numpy.array(spec['ry'][start:stop]), numpy.array(spec['rz']), spec['shots'], workers, spec['method'], seed, properties, task['initial_layout'])
+	tmp = os.path.join(path, 'done', '{}.{}.{}.tmp.npz'.format(name[:-len('.json')], socket.gethostname(), os.getpid()))
+	numpy.savez(tmp, method=method, **results)
+	os.replace(tmp, os.path.join(path, 'done', name[:-len('.json')] + '.npz'))
+
+def work(path, lane=None, workers=os.cpu_count(), heartbeat=30, timeout=300, poll=10):
+	spec = _read_json(os.path.join(path, 'spec.json'))
+	lane = zlib.crc32(socket.gethostname().encode()) if lane is None else lane
+	completed = 0
+	while True:
+		name = claim_shard(path, lane)
+		if name is None:
+			if reclaim_shards(path, timeout):
+				continue
+			if not os.listdir(os.path.join(path, 'running')):
+				return completed
+			time.sleep(poll) # wait for running shards to finish or time out
+			continue
+		running = os.path.join(path, 'running', name)
+		stop, lost = threading.Event(), threading.Event()
+		thread = threading.Thread(target=_heartbeat, args=(running, heartbeat, stop, lost), daemon=True)
+		thread.start()
+		try:
+			run_shard(path, spec, name, workers)
+		finally:
+			stop.set()
+			thread.join()
+		_remove(running)
+		completed += 1
+		print("{}: shard {} done{}".format(socket.gethostname(), name[:-len('.json')], ' (claim lost, result kept)' if lost.is_set() else ''))
+
+def merge(path, output):
+	spec = _read_json(os.path.join(path, 'spec.json'))
+	ry, rz = numpy.array(spec['ry']), numpy.array(spec['rz'])
+	os.makedirs(output, exist_ok=True)
+	done = os.path.join(path, 'done')
+	incomplete = []
+	for t, task in enumerate(spec['tasks']):
+		name = "{}_{}_{}{}".format(task['layout'], task['locc'], task['topology'] or 'default', '' if task['calibration'] is None else '_' + os.path.splitext(os.path.basename(task['calibration']))[0])
+		shards = sorted(file for file in os.listdir(done) if file.startswith('{:04d}_'.format(t)) and file.endswith('.npz') and '.tmp' not in file)
+		rows = [int(file[5:-len('.npz')]) for file in shards]
+		parts = [numpy.load(os.path.join(done, file)) for file in shards]
+		if (sum(len(part['probabilities']) for part in parts) != len(ry)):
+			incomplete.append(name)
+			continue
+		results = {key: numpy.concatenate([part[key] for _, part in sorted(zip(rows, parts), key=lambda item: item[0])]) for key in ['rhos', 'fidelities', 'probabilities']}
+		metadata = dict(task, shots=spec['shots'], seed=spec['seed'], methods=sorted(set(str(part['method']) for part in parts)))
+		numpy.savez(os.path.join(output, name + '.npz'), ryangles=ry, rzangles=rz, metadata=json.dumps(metadata), **results)
+	return incomplete
+
+def check_queue(timeout=60):
+	path = tempfile.mkdtemp()
+	failed = []
+	try:
+		shards = init_queue(path, queue_tasks(['PCC', 'APCC'], ['dfm', 'postselect']), numpy.linspace(0, 3, 6), numpy.linspace(0, 6, 5), 2000, 2, 2, seed=1)
+		old = time.time() - 3600
+		for lane in os.listdir(os.path.join(path, 'pending')):
+			for name in os.listdir(os.path.join(path, 'pending', lane)):
+				os.utime(os.path.join(path, 'pending', lane, name), (old, old))
+		name = claim_shard(path, 0)
+		if reclaim_shards(path, timeout):
+			failed.append('fresh claim of an aged pending shard reclaimed')
+			name = claim_shard(path, 0)
+		os.utime(os.path.join(path, 'running', name), (old, old)) # its node died
+		if (reclaim_shards(path, timeout) != 1 or reclaim_shards(path, timeout) != 0):
+			failed.append('dead node shard not reclaimed exactly once')
+		with Pool(2) as pool:
+			completed = pool.starmap(work, [(path, lane, 1, 1, timeout, 0.2) for lane in range(2)])
+		if (sum(completed) != shards):
+			failed.append('{} shard runs for {} shards'.format(sum(completed), shards))
+		if merge(path, os.path.join(path, 'merged')):
+			failed.append('incomplete merge')
+	finally:
+		shutil.rmtree(path)
+	return failed
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='multi-node telecloning sweeps through a work queue on a shared filesystem')
+	subparsers = parser.add_subparsers(dest='command', required=True)
+	init_parser = subparsers.add_parser('init', help='create the queue and its shards')
+	init_parser.add_argument('queue')
+	init_parser.add_argument('--layouts', nargs='+', required=True, help="e.g. PCC APCC PCCC AAPCCC")
+	init_parser.add_argument('--loccs', nargs='+', default=['dfm'], help="'dfm', 'locc', 'postselect' or 'psXZ'")
+	init_parser.add_argument('--topologies', nargs='+', default=[None], help="'LNN' or 'full' (default as in run_sweep_local)")
+	init_parser.add_argument('--calibrations', nargs='+', default=[None], help="calibration snapshots for noise models, 'none' for noiseless")
+	init_parser.add_argument('--initial-layout', type=int, nargs='+', default=None)
+	init_parser.add_argument('--ry', type=float, nargs=3, default=[0, 2*math.pi, 100], metavar=('START', 'STOP', 'NUM'))
+	init_parser.add_argument('--rz', type=float, nargs=3, default=[0, 2*math.pi, 100], metavar=('START', 'STOP', 'NUM'))
+	init_parser.add_argument('--shots', type=int, default=30000)
+	init_parser.add_argument('--shard-rows', type=int, default=1, help='Ry rows per shard')
+	init_parser.add_argument('--lanes', type=int, default=1, help='number of nodes expected (one lane each)')
+	init_parser.add_argument('--method', default='auto')
+	init_parser.add_argument('--seed', type=int, default=None)
+	work_parser = subparsers.add_parser('work', help='claim and run shards until the queue is empty')
+	work_parser.add_argument('queue')
+	work_parser.add_argument('--lane', type=int, default=None, help='own lane (default: from the host name)')
+	work_parser.add_argument('--workers', type=int, default=os.cpu_count())
+	work_parser.add_argument('--heartbeat', type=float, default=30, help='seconds between heartbeats')
+	work_parser.add_argument('--timeout', type=float, default=300, help='seconds without heartbeat before a shard is reclaimed')
+	work_parser.add_argument('--poll', type=float, default=10)
+	merge_parser = subparsers.add_parser('merge', help='assemble the results per task')
+	merge_parser.add_argument('queue')
+	merge_parser.add_argument('--output', required=True)
+	subparsers.add_parser('check', help='claim/reclaim checks on a temporary queue')
+	args = parser.parse_args()
+	if (args.command == 'init'):
+		calibrations = [None if c.lower() == 'none' else os.path.abspath(c) for c in args.calibrations] if args.calibrations != [None] else [None]
+		tasks = queue_tasks(args.layouts, args.loccs, args.topologies, calibrations, args.initial_layout)
+		ry = numpy.linspace(args.ry[0], args.ry[1], num=int(args.ry[2]))
+		rz = numpy.linspace(args.rz[0], args.rz[1], num=int(args.rz[2]))
+		print("{} tasks in {} shards".format(len(tasks), init_queue(args.queue, tasks, ry, rz, args.shots, args.shard_rows, args.lanes, args.method, args.seed)))
+	elif (args.command == 'work'):
+		t0 = time.time()
+		completed = work(args.queue, args.lane, args.workers, args.heartbeat, args.timeout, args.poll)
+		print("{}: {} shards in {:.1f}s".format(socket.gethostname(), completed, time.time()-t0))
+	elif (args.command == 'check'):
+		failed = check_queue()
+		print("failed: {}".format(', '.join(failed)) if failed else "all queue checks passed")
+		sys.exit(1 if failed else 0)
+	else:
+		incomplete = merge(args.queue, args.output)
+		print("incomplete tasks: {}".format(', '.join(incomplete)) if incomplete else "all tasks merged")
+		sys.exit(1 if incomplete else 0)
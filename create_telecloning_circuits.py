@@ -10,12 +10,384 @@ derivative works, distribute copies to the public, perform publicly and display
 others to do so.
 """
 
-from qiskit import QuantumRegister, ClassicalRegister, QuantumCircuit
+from qiskit import QuantumRegister, ClassicalRegister, QuantumCircuit, transpile
+from qiskit.circuit import Parameter, Measure, Barrier, CircuitInstruction
+from qiskit.circuit.library import RYGate, RZGate, XGate, ZGate, HGate, SdgGate, CXGate, Initialize
 import qiskit.quantum_info as qi
 import numpy
 import time
 import math
 from copy import deepcopy
+from functools import lru_cache
+from collections import namedtuple
+import hashlib
+import itertools
+import json
+import os
+
+''' TCcircuit
+    lightweight gate list intermediate representation (IR) of the telecloning circuits
+    - one entry per gate in parallel lists: opcodes, qubit tuples, classical bit tuples, parameters, conditions
+    - mirrors the subset of the QuantumCircuit interface used by the circuit functions below:
+      ry, rz, x, z, h, sdg, cx (with Qiskit-style list broadcasting), measure, barrier, compose
+    - classically conditioned gates take condition=(clbit, value), i.e. x(q, condition=(c,1)) for .c_if
+    - converts to Qiskit (to_qiskit, to_instruction), OpenQASM 2 (to_qasm) or OpenQASM 3 (to_qasm3) only at the boundary
+    - dynamic circuits (to_qiskit(dynamic=True), to_qasm3) group the conditioned gates into if blocks, see conditional_blocks
+    - to_arrays / from_arrays serialize the gate list as numpy arrays (Parameters by name), digest hashes them for caching
+    - freeze() makes the gate list immutable, so it can be shared (e.g. by cached_block) and composed without copying
+'''
+IR_OPCODES = ('ry', 'rz', 'x', 'z', 'h', 'sdg', 'cx', 'measure', 'barrier')
+IR_OPCODE = {name: i for i, name in enumerate(IR_OPCODES)}
+_IR_GATE_MATRICES = {2: ((0, 1), (1, 0)), 3: ((1, 0), (0, -1)), 4: ((2**-0.5, 2**-0.5), (2**-0.5, -2**-0.5)), 5: numpy.array(((1, 0), (0, -1j)))}
+class TCcircuit:
+    __slots__ = ['num_qubits', 'num_clbits', 'qreg', 'creg', 'opcodes', 'qargs', 'cargs', 'params', 'conditions', 'frozen', '_instruction']
+
+    def __init__(self, num_qubits, num_clbits=0, qreg='q', creg='c'):
+        self.num_qubits = num_qubits
+        self.num_clbits = num_clbits
+        self.qreg = qreg
+        self.creg = creg
+        self.opcodes = []
+        self.qargs = []
+        self.cargs = []
+        self.params = []
+        self.conditions = []
+        self.frozen = False
+        self._instruction = None
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __iter__(self):
+        for op, q, c, p, cond in zip(self.opcodes, self.qargs, self.cargs, self.params, self.conditions):
+            yield IR_OPCODES[op], q, c, p, cond
+
+    def _append(self, opcode, qargs, cargs=(), param=None, condition=None):
+        if self.frozen:
+            raise ValueError("cannot modify a frozen TCcircuit")
+        self.opcodes.append(opcode)
+        self.qargs.append(qargs)
+        self.cargs.append(cargs)
+        self.params.append(param)
+        self.conditions.append(condition)
+        return self
+
+    def _single(self, opcode, qubits, param=None, condition=None):
+        for q in (qubits if isinstance(qubits, (list, tuple, range)) else [qubits]):
+            self._append(opcode, (int(q),), (), param, condition)
+        return self
+
+    def ry(self, theta, qubits, condition=None):
+        return self._single(0, qubits, theta, condition)
+    def rz(self, phi, qubits, condition=None):
+        return self._single(1, qubits, phi, condition)
+    def x(self, qubits, condition=None):
+        return self._single(2, qubits, None, condition)
+    def z(self, qubits, condition=None):
+        return self._single(3, qubits, None, condition)
+    def h(self, qubits, condition=None):
+        return self._single(4, qubits, None, condition)
+    def sdg(self, qubits, condition=None):
+        return self._single(5, qubits, None, condition)
+
+    def cx(self, controls, targets, condition=None):
+        controls = [*controls] if isinstance(controls, (list, tuple, range)) else [controls]
+        targets = [*targets] if isinstance(targets, (list, tuple, range)) else [targets]
+        if len(controls) == 1:
+            controls = controls*len(targets)
+        if len(targets) == 1:
+            targets = targets*len(controls)
+        assert len(controls) == len(targets), "cx control and target lists must have equal length"
+        for c, t in zip(controls, targets):
+            self._append(6, (int(c), int(t)), (), None, condition)
+        return self
+
+    def measure(self, qubits, clbits):
+        qubits = [*qubits] if isinstance(qubits, (list, tuple, range)) else [qubits]
+        clbits = [*clbits] if isinstance(clbits, (list, tuple, range)) else [clbits]
+        for q, c in zip(qubits, clbits):
+            self._append(7, (int(q),), (int(c),))
+        return self
+
+    ''' barriers always span all qubits '''
+    def barrier(self):
+        return self._append(8, tuple(range(self.num_qubits)))
+
+    ''' compose other into self (inplace) or a copy, mapping other's qubit i to qubits[i], clbit j to clbits[j] '''
+    def compose(self, other, qubits=None, clbits=None, inplace=False):
+        target = self if inplace else self.copy()
+        qmap = [*range(other.num_qubits)] if qubits is None else [*qubits]
+        cmap = [*range(other.num_clbits)] if clbits is None else [*clbits]
+        for op, q, c, p, cond in zip(other.opcodes, other.qargs, other.cargs, other.params, other.conditions):
+            target._append(op, tuple(qmap[i] for i in q), tuple(cmap[i] for i in c), p, None if cond is None else (cmap[cond[0]], cond[1]))
+        return None if inplace else target
+
+    def copy(self):
+        out = TCcircuit(self.num_qubits, self.num_clbits, self.qreg, self.creg)
+        out.opcodes = [*self.opcodes]
+        out.qargs = [*self.qargs]
+        out.cargs = [*self.cargs]
+        out.params = [*self.params]
+        out.conditions = [*self.conditions]
+        return out
+
+    def freeze(self):
+        self.frozen = True
+        return self
+
+    ''' copy with symbolic parameters (e.g. Qiskit Parameters) replaced according to the dictionary values '''
+    def assign_parameters(self, values):
+        out = self.copy()
+        out.params = [values.get(p, p) if isinstance(p, Parameter) else p for p in out.params]
+        return out
+
+    def count_ops(self):
+        counts = {}
+        for op in self.opcodes:
+            counts[IR_OPCODES[op]] = counts.get(IR_OPCODES[op], 0) + 1
+        return counts
+
+    def depth(self):
+        level = [0]*(self.num_qubits + self.num_clbits)
+        for op, q, c, cond in zip(self.opcodes, self.qargs, self.cargs, self.conditions):
+            wires = [*q, *[self.num_qubits+i for i in c]] + ([] if cond is None else [self.num_qubits+cond[0]])
+            # barriers align the qubits without adding depth, as in QuantumCircuit.depth
+            d = (op != 8) + max(level[w] for w in wires)
+            for w in wires:
+                level[w] = d
+        return max(level, default=0)
+
+    ''' deferred measurement principle: measurements are dropped and gates conditioned on a measured bit become gates
+        controlled by the measured qubit (X -> CX, Z -> H CX H, with X on the control around them for condition value 0)
+        - measured qubits must not be acted on after their measurement, as in LOCC; then the other qubits end in the same
+          (reduced) state and the measured qubits hold the outcome distribution of their classical bits
+        - returns the gate list without classical bits and the dictionary {clbit: qubit} of the removed measurements '''
+    def defer_measurements(self):
+        out = TCcircuit(self.num_qubits, qreg=self.qreg)
+        measured = {}
+        for op, q, c, p, cond in zip(self.opcodes, self.qargs, self.cargs, self.params, self.conditions):
+            if (op == 7):
+                measured[c[0]] = q[0]
+                continue
+            if (op != 8 and any(i in measured.values() for i in q)):
+                raise ValueError("cannot defer the measurement of a qubit that is acted on afterwards")
+            if (cond is None):
+                out._append(op, q, (), p)
+                continue
+            if (op not in (2, 3) or cond[0] not in measured):
+                raise ValueError("only X and Z gates conditioned on measured bits can be deferred")
+            control = measured[cond[0]]
+            if not cond[1]:
+                out.x(control)
+            if (op == 2):
+                out.cx(control, q[0])
+            else:
+                out.h(q[0]).cx(control, q[0]).h(q[0])
+            if not cond[1]:
+                out.x(control)
+        return out, measured
+
+    ''' statevector simulation with numpy (Qiskit little endian), for gate lists without measurements and conditions
+        - state: input statevector (default |0...0⟩), or an array of shape (2**num_qubits, k) of k statevectors
+        - real inputs stay real as long as only real gates (ry, x, z, h, cx) occur, parameters must be bound '''
+    def evolve(self, state=None):
+        n = self.num_qubits
+        if state is None:
+            state = numpy.zeros(2**n)
+            state[0] = 1
+        else:
+            state = numpy.array(state)
+        batch = int(numpy.prod(state.shape[1:], dtype=int))
+        for op, q, p, cond in zip(self.opcodes, self.qargs, self.params, self.conditions):
+            if (op == 7 or cond is not None):
+                raise ValueError("evolve simulates gate lists without measurements and classical conditions only")
+            if (op == 8):
+                continue
+            if (op == 6):
+                control, target = q
+                high, low = max(q), min(q)
+                view = state.reshape(2**(n-1-high), 2, 2**(high-low-1), 2, 2**low*batch)
+                ones, flip = ((slice(None), 1, slice(None)), 3) if (control == high) else ((slice(None), slice(None), slice(None), 1), 1)
+                block = view[ones]
+                if (flip == 3):
+                    block[:, :, [0, 1]] = block[:, :, [1, 0]]
+                else:
+                    block[:, [0, 1]] = block[:, [1, 0]]
+                continue
+            if (op == 0):
+                c, s = math.cos(float(p)/2), math.sin(float(p)/2)
+                gate = ((c, -s), (s, c))
+            elif (op == 1):
+                gate = ((numpy.exp(-0.5j*float(p)), 0), (0, numpy.exp(0.5j*float(p))))
+            else:
+                gate = _IR_GATE_MATRICES[op]
+            if (numpy.iscomplexobj(gate) and not numpy.iscomplexobj(state)):
+                state = state.astype(complex)
+            view = state.reshape(2**(n-1-q[0]), 2, 2**q[0]*batch)
+            zero = view[:, 0].copy()
+            view[:, 0] = gate[0][0]*zero + gate[0][1]*view[:, 1]
+            view[:, 1] = gate[1][0]*zero + gate[1][1]*view[:, 1]
+        return state
+
+    def to_arrays(self):
+        qargs = numpy.full((len(self), 2), -1, dtype=numpy.int32)
+        cargs = numpy.full(len(self), -1, dtype=numpy.int32)
+        conditions = numpy.full((len(self), 2), -1, dtype=numpy.int32)
+        for i, (op, q, c, cond) in enumerate(zip(self.opcodes, self.qargs, self.cargs, self.conditions)):
+            if op != 8:
+                qargs[i, :len(q)] = q
+            if c:
+                cargs[i] = c[0]
+            if cond is not None:
+                conditions[i] = cond
+        # symbolic parameters (Qiskit Parameters) by name, NaN in the float slot
+        symbolic = [isinstance(p, Parameter) for p in self.params]
+        params = numpy.array([numpy.nan if (p is None or sym) else float(p) for p, sym in zip(self.params, symbolic)], dtype=float)
+        param_names = numpy.array([p.name if sym else '' for p, sym in zip(self.params, symbolic)], dtype=str)
+        return {'num_qubits': self.num_qubits, 'num_clbits': self.num_clbits,
+                'opcodes': numpy.array(self.opcodes, dtype=numpy.int8), 'qargs': qargs, 'cargs': cargs,
+                'params': params, 'param_names': param_names, 'conditions': conditions}
+
+    ''' parameters: {name: Parameter} for the symbolic parameters, so that assign_parameters can bind them (default: new
+        Parameters of the stored names) '''
+    @staticmethod
+    def from_arrays(arrays, qreg='q', creg='c', parameters=None):
+        out = TCcircuit(int(arrays['num_qubits']), int(arrays['num_clbits']), qreg, creg)
+        parameters = {} if parameters is None else parameters
+        names = arrays.get('param_names', [''] * len(arrays['opcodes']))
+        for op, q, c, p, name, cond in zip(arrays['opcodes'], arrays['qargs'], arrays['cargs'], arrays['params'], names, arrays['conditions']):
+            op = int(op)
+            qargs = tuple(range(out.num_qubits)) if op == 8 else tuple(int(i) for i in q if i >= 0)
+            if name:
+                p = parameters.setdefault(str(name), Parameter(str(name)))
+            else:
+                p = None if numpy.isnan(p) else float(p)
+            out._append(op, qargs, () if c < 0 else (int(c),), p, None if cond[0] < 0 else (int(cond[0]), int(cond[1])))
+        return out
+
+    def digest(self):
+        arrays = self.to_arrays()
+        h = hashlib.sha1(numpy.array([arrays['num_qubits'], arrays['num_clbits']], dtype=numpy.int64).tobytes())
+        for key in ['opcodes', 'qargs', 'cargs', 'params', 'conditions']:
+            h.update(numpy.ascontiguousarray(arrays[key]).tobytes())
+        if arrays['param_names'].any():
+            h.update('\0'.join(arrays['param_names']).encode())
+        return h.hexdigest()
+
+    ''' blocks of gates for dynamic circuits, as a list of (condition, gate indices), condition None for single unconditioned gates
+        - a conditioned gate joins the last block with the same condition if it commutes with all conditioned gates in between
+          (disjoint qubits), e.g. the interleaved X/Z clone corrections of LOCC(locc='locc') become one X and one Z block '''
+    def conditional_blocks(self):
+        blocks = []
+        for i, (q, cond) in enumerate(zip(self.qargs, self.conditions)):
+            target = None
+            if cond is not None:
+                for block in reversed(blocks):
+                    if block[0] == cond:
+                        target = block
+                    if block[0] is None or block[0] == cond or any(set(q) & set(self.qargs[j]) for j in block[1]):
+                        break
+            if target is None:
+                blocks.append((cond, [i]))
+            else:
+                target[1].append(i)
+        return blocks
+
+    ''' dynamic=True writes the conditioned gates as if_test blocks instead of .c_if '''
+    def to_qiskit(self, dynamic=False):
+        qr = QuantumRegister(self.num_qubits, name=self.qreg)
+        if self.num_clbits:
+            cr = ClassicalRegister(self.num_clbits, name=self.creg)
+            qc = QuantumCircuit(qr, cr)
+        else:
+            qc = QuantumCircuit(qr)
+        gates = [RYGate, RZGate, XGate, ZGate, HGate, SdgGate, CXGate]
+        if dynamic:
+            for cond, indices in self.conditional_blocks():
+                if cond is not None:
+                    # append (not _append), so that the if_test builder collects the gates
+                    with qc.if_test((cr[cond[0]], cond[1])):
+                        for i in indices:
+                            op, p = self.opcodes[i], self.params[i]
+                            qc.append(gates[op](p) if op <= 1 else gates[op](), [qr[j] for j in self.qargs[i]], [])
+                    continue
+                op, q, c, p = self.opcodes[indices[0]], self.qargs[indices[0]], self.cargs[indices[0]], self.params[indices[0]]
+                if op == 7:
+                    qc._append(Measure(), [qr[q[0]]], [cr[c[0]]])
+                elif op == 8:
+                    qc._append(Barrier(len(q)), [qr[i] for i in q], [])
+                else:
+                    qc._append(gates[op](p) if op <= 1 else gates[op](), [qr[i] for i in q], [])
+            return qc
+        for op, q, c, p, cond in zip(self.opcodes, self.qargs, self.cargs, self.params, self.conditions):
+            if op == 7:
+                qc._append(Measure(), [qr[q[0]]], [cr[c[0]]])
+            elif op == 8:
+                qc._append(Barrier(len(q)), [qr[i] for i in q], [])
+            else:
+                gate = gates[op](p) if op <= 1 else gates[op]()
+                if cond is not None:
+                    gate = gate.c_if(cr[cond[0]], cond[1])
+                qc._append(gate, [qr[i] for i in q], [])
+        return qc
+
+    ''' memoized for frozen circuits, so shared blocks are converted only once '''
+    def to_instruction(self, name=None):
+        if self.frozen and self._instruction is not None:
+            return self._instruction
+        qc = self.to_qiskit()
+        if name is not None:
+            qc.name = name
+        instruction = qc.to_instruction()
+        if self.frozen:
+            self._instruction = instruction
+        return instruction
+
+    ''' OpenQASM 2 string; conditions are written per classical bit, if(c[i]==1), as in the Quantinuum dialect
+        unbound Parameters are written as {name}, i.e. the string of a template is a str.format pattern '''
+    def to_qasm(self, include='qelib1.inc'):
+        lines = ['OPENQASM 2.0;', 'include "{}";'.format(include), 'qreg {}[{}];'.format(self.qreg, self.num_qubits)]
+        if self.num_clbits:
+            lines.append('creg {}[{}];'.format(self.creg, self.num_clbits))
+        for op, q, c, p, cond in zip(self.opcodes, self.qargs, self.cargs, self.params, self.conditions):
+            qubits = ','.join('{}[{}]'.format(self.qreg, i) for i in q)
+            if op == 7:
+                line = 'measure {} -> {}[{}];'.format(qubits, self.creg, c[0])
+            elif op <= 1:
+                angle = '{'+p.name+'}' if isinstance(p, Parameter) else repr(float(p))
+                line = '{}({}) {};'.format(IR_OPCODES[op], angle, qubits)
+            else:
+                line = '{} {};'.format(IR_OPCODES[op], qubits)
+            if cond is not None:
+                line = 'if({}[{}]=={}) {}'.format(self.creg, cond[0], cond[1], line)
+            lines.append(line)
+        return '\n'.join(lines)+'\n'
+
+    ''' OpenQASM 3 string for dynamic-circuit backends; conditioned gates are grouped into if blocks (see conditional_blocks)
+        unbound Parameters are declared as input float[64], so one program serves all their values '''
+    def to_qasm3(self, include='stdgates.inc'):
+        lines = ['OPENQASM 3.0;', 'include "{}";'.format(include)]
+        lines += ['input float[64] {};'.format(name) for name in dict.fromkeys(p.name for p in self.params if isinstance(p, Parameter))]
+        lines.append('qubit[{}] {};'.format(self.num_qubits, self.qreg))
+        if self.num_clbits:
+            lines.append('bit[{}] {};'.format(self.num_clbits, self.creg))
+        def line(i):
+            op, q, c, p = self.opcodes[i], self.qargs[i], self.cargs[i], self.params[i]
+            qubits = ', '.join('{}[{}]'.format(self.qreg, j) for j in q)
+            if op == 7:
+                return '{}[{}] = measure {};'.format(self.creg, c[0], qubits)
+            if op <= 1:
+                return '{}({}) {};'.format(IR_OPCODES[op], p.name if isinstance(p, Parameter) else repr(float(p)), qubits)
+            return '{} {};'.format(IR_OPCODES[op], qubits)
+        for cond, indices in self.conditional_blocks():
+            if cond is None:
+                lines.append(line(indices[0]))
+            else:
+                lines.append('if ({}{}[{}]) {{'.format('' if cond[1] else '!', self.creg, cond[0]))
+                lines += ['  '+line(i) for i in indices]
+                lines.append('}')
+        return '\n'.join(lines)+'\n'
+
 
 ''' message creation functions
     - message_ry does real amplitudes
@@ -33,6 +405,22 @@ def message_ry_rz(angle_ry, angle_rz):
     qc_message.rz(angle_rz, 0)
     return qc_message
 
+''' message_statevectors
+    - statevectors Rz(angle_rz) Ry(angle_ry) |0⟩, computed directly from the angles
+    - angles can be floats or numpy arrays (broadcast against each other), output has shape (..., 2)
+    message_density_matrix
+    - density matrix of message_ry_rz(angle_ry, angle_rz), identical to DensityMatrix.from_instruction
+'''
+def message_statevectors(angle_ry, angle_rz):
+    angle_ry, angle_rz = numpy.broadcast_arrays(numpy.asarray(angle_ry, dtype=float), numpy.asarray(angle_rz, dtype=float))
+    psi = numpy.empty(angle_ry.shape+(2,), dtype=complex)
+    psi[...,0] = numpy.cos(angle_ry/2)*numpy.exp(-0.5j*angle_rz)
+    psi[...,1] = numpy.sin(angle_ry/2)*numpy.exp(0.5j*angle_rz)
+    return psi
+def message_density_matrix(angle_ry, angle_rz):
+    psi = message_statevectors(angle_ry, angle_rz)
+    return qi.DensityMatrix(numpy.outer(psi, psi.conj()))
+
 ''' fracAngle(l,n) 
     is an angle theta, such that Ry(theta)|0⟩ = sqrt(l/n)|0⟩ + sqrt(1-l/n)|1⟩'''
 def fracAngle(l,n):
@@ -41,19 +429,20 @@ def fracAngle(l,n):
 
 ''' Split & Cyclic Shift Unitary SCS
     creates a circuit such that SCS(m) |0^(n-l)1^l⟩ = sqrt(l/n)|1 0^(n-l) 1^(l-1)⟩ + sqrt(1-l/n)|0^(n-l)1^l⟩
+    - min_weight: only inputs of Hamming weight l >= min_weight are needed, blocks acting on lower weights are left out
 '''
-def SCS(m=2):
-    qr_SCS = QuantumRegister(m, name='qSCS{}{}'.format(m,m))
-    qc_SCS = QuantumCircuit(qr_SCS)
+def SCS(m=2, IR=False, min_weight=0):
+    qc_SCS = TCcircuit(m, qreg='qSCS{}{}'.format(m,m))
     # circuit, little endian
     # blocki
-    qc_SCS.ry(1.0*(numpy.pi)/2, 1)
-    qc_SCS.cx(1,0)
-    qc_SCS.ry(0.5*fracAngle(m-1,m),[0,1])
-    qc_SCS.cx(1,0)
-    qc_SCS.ry(-1.0*(numpy.pi)/2,1)
+    if (min_weight <= 1):
+        qc_SCS.ry(1.0*(numpy.pi)/2, 1)
+        qc_SCS.cx(1,0)
+        qc_SCS.ry(0.5*fracAngle(m-1,m),[0,1])
+        qc_SCS.cx(1,0)
+        qc_SCS.ry(-1.0*(numpy.pi)/2,1)
     # blockii
-    for i in range(1,m-1):
+    for i in range(max(1,min_weight-1),m-1):
         qc_SCS.cx(i,i+1)
         qc_SCS.ry(-0.25*fracAngle(i+1,m),i)
         qc_SCS.cx(i-1, i)
@@ -64,20 +453,24 @@ def SCS(m=2):
         qc_SCS.ry(0.25*fracAngle(i+1,m),i)
         qc_SCS.cx(i,i+1)
     # return
-    return qc_SCS
+    return qc_SCS if IR else qc_SCS.to_qiskit()
 
 
 ''' Dicke State Unitary DSU
     creates a circuit such that DSU(m) |0^(n-l)1^l⟩ = |D^n_l⟩
+    - min_weight: only for input Hamming weights l >= min_weight, with O(m (m-min_weight)) instead of O(m^2) CX gates
 '''
-def DSU(m=2):
-    qr_DSU = QuantumRegister(m, name='qU{}{}'.format(m,m))
-    qc_DSU = QuantumCircuit(qr_DSU)
+def DSU(m=2, IR=False, min_weight=0):
+    qc_DSU = TCcircuit(m, qreg='qU{}{}'.format(m,m))
     # circuit, little endian
     for l in range(m,1,-1):
-        qc_DSU.compose(SCS(l), qubits=[*range(0,l)], inplace=True)
+        if (min_weight > 0):
+            # SCS(l) acts on the l lowest qubits, whose Hamming weight is at least min_weight-(m-l)
+            qc_DSU.compose(SCS(l,IR=True,min_weight=min_weight-(m-l)), qubits=[*range(0,l)], inplace=True)
+        else:
+            qc_DSU.compose(cached_block('SCS',l,IR=True), qubits=[*range(0,l)], inplace=True)
     # return
-    return qc_DSU
+    return qc_DSU if IR else qc_DSU.to_qiskit()
 ''' old version '''
 def DSU_old(m=2):
     qr_DSU = QuantumRegister(m, name='qU{}{}'.format(m,m))
@@ -105,18 +498,100 @@ def DSU_old(m=2):
     return qc_DSU
 
 
+''' Dicke_statevector
+    statevector of the Dicke state |D^m_l⟩ on m qubits (Qiskit little endian ordering)
+    verify_DSU
+    checks a Dicke State Unitary candidate qc on m qubits (QuantumCircuit or TCcircuit, default DSU(m,min_weight=min_weight)):
+    - returns the largest deviation ‖qc|0^(m-l)1^l⟩ - |D^m_l⟩‖ over all input Hamming weights l = min_weight..m
+    - every weight occurs in the input of TCstate, so a replacement for DSU must pass for all of them
+'''
+def Dicke_statevector(m, l):
+    weights = numpy.array([bin(i).count('1') for i in range(2**m)])
+    return (weights == l)/numpy.sqrt(math.comb(m, l))
+def verify_DSU(m, qc=None, min_weight=0):
+    qc = DSU(m, IR=True, min_weight=min_weight) if qc is None else qc
+    inputs = numpy.zeros((2**m, m+1-min_weight))
+    inputs[[2**l-1 for l in range(min_weight, m+1)], range(m+1-min_weight)] = 1
+    outputs = evolve_statevectors(qc, inputs)
+    return float(max(numpy.linalg.norm(outputs[:, l-min_weight] - Dicke_statevector(m, l)) for l in range(min_weight, m+1)))
+
+
+''' Topologies
+    - 'LNN':      linear nearest neighbor between the TCstate qubits + edge between message & port, i.e. a T-shaped
+                  coupling graph with the port as the branching qubit (a path if there are no ancillas)
+    - 'heavyhex': the 'LNN' gates, whose T-shaped coupling graph embeds into a heavy-hex lattice with the port on a
+                  degree 3 qubit, see heavy_hex_layout for placing it on a device without SWAPs
+    - 'full':     all-to-all connectivity (any other topology)
+'''
+LNN_TOPOLOGIES = ('LNN', 'heavyhex')
+
+
+''' Tree-structured O(log m) depth stages for full connectivity
+    doubling_rounds(nodes)
+    - binomial tree over the list nodes: rounds of disjoint (parent, child) pairs, after round k the first 2^k nodes are reached
+    fanout_tree(qc, control, targets)
+    - equivalent to qc.cx([control]*len(targets), targets), for targets in any state: the targets are mapped to differences
+      along a doubling tree, where adding the control to all targets only changes the root, and mapped back
+    fanin_tree(qc, controls, target)
+    - equivalent to qc.cx(controls, [target]*len(controls)): the parity of the controls is accumulated in the tree root,
+      copied onto the target and uncomputed
+    dfm_full(qc, qpos, log_depth)
+    - the 'dfm' LOCC stage on full connectivity: the Bell CX, port fan-out and message fan-in, linear (depth m+2) or
+      for log_depth fanout_tree/fanin_tree (depth 4 ceil(log2 m) + 2, 2m-2 more CX gates)
+    - LOG_DEPTH_MIN_M: the smallest m for which the trees are shallower, LOCC keeps the linear stage below it
+'''
+LOG_DEPTH_MIN_M = 21
+def doubling_rounds(nodes):
+    rounds = []
+    reached = 1
+    while reached < len(nodes):
+        rounds.append([(nodes[i], nodes[i+reached]) for i in range(min(reached, len(nodes)-reached))])
+        reached *= 2
+    return rounds
+def fanout_tree(qc, control, targets):
+    rounds = doubling_rounds(targets)
+    for pairs in reversed(rounds):
+        for parent, child in pairs:
+            qc.cx(parent, child)
+    qc.cx(control, targets[0])
+    for pairs in rounds:
+        for parent, child in pairs:
+            qc.cx(parent, child)
+    return qc
+def fanin_tree(qc, controls, target):
+    rounds = doubling_rounds(controls)
+    for pairs in reversed(rounds):
+        for parent, child in pairs:
+            qc.cx(child, parent)
+    qc.cx(controls[0], target)
+    for pairs in rounds:
+        for parent, child in pairs:
+            qc.cx(child, parent)
+    return qc
+def dfm_full(qc, qpos, log_depth=False):
+    m = len(qpos['clones'])
+    qc.cx(qpos['message'], qpos['port'])                # bell measurement cnot
+    if (log_depth):
+        fanout_tree(qc, qpos['port'], qpos['clones'])   # port-controlled clone-Xgates
+        fanin_tree(qc, qpos['clones'], qpos['message']) # message-controlled clone-Zgates
+    else:
+        qc.cx([qpos['port']]*m, qpos['clones'])         # port-controlled clone-Xgates
+        qc.cx(qpos['clones'], [qpos['message']]*m)      # message-controlled clone-Zgates
+    #qc.h(qpos['message']) # bell measurement h, not necessary for dfm
+    return qc
+
+
 ''' inputHW
     - creates the entangled Hamming Weight Superpositions to be fed into Dicke State Unitaries
     - general method for Ancilla TeleCloning State, for both LNN and Full Connectivity
     - methods for m=2 and m=3 without ancillas, for both LNN and Full connectivity
 '''
-def inputHW(m=2,ancilla=True,topology='LNN'):
-    qr_HW = QuantumRegister(2*m if ancilla else m+1, name='qHW')
-    qc_HW = QuantumCircuit(qr_HW)
+def inputHW(m=2,ancilla=True,topology='LNN',IR=False):
+    qc_HW = TCcircuit(2*m if ancilla else m+1, qreg='qHW')
     # TCstate A^(m-1)PC^m
     if (ancilla):
         # entangling Hamming weights on LNN connectivity
-        if (topology == 'LNN'):
+        if (topology in LNN_TOPOLOGIES):
             qc_HW.ry(fracAngle(1,m+1),m-1)
             qc_HW.cx(m-1,m)
             for i in range(1,m):
@@ -148,7 +623,7 @@ def inputHW(m=2,ancilla=True,topology='LNN'):
             qc_HW.ry(fracAngle(2,3),0)
             qc_HW.cx(0,1)
         elif (m == 3):
-            if (topology == 'LNN'):
+            if (topology in LNN_TOPOLOGIES):
                 qc_HW.ry(fracAngle(2,3),0)
                 qc_HW.cx(0,1)
                 qc_HW.ry(0.5*fracAngle(1,2),2)         
@@ -172,34 +647,119 @@ def inputHW(m=2,ancilla=True,topology='LNN'):
                 qc_HW.x(0)   
                 
     # return
-    return qc_HW
+    return qc_HW if IR else qc_HW.to_qiskit()
+
+''' TCstate lookup table
+    ancilla-free P C^m telecloning states for m>3, found offline by synthesize_TCstate.py and stored in TCSTATE_TABLE
+    - one entry per 'm,topology' with the gate list [name, qubits(, angle)] on port (qubit 0) + clones,
+      its CX count and verify_TCstate deviation
+    TCstate_from_table
+    - frozen TCcircuit of the entry for m and topology, None if there is none
+    - 'heavyhex' uses the 'LNN' entries, full connectivity falls back to them if there is no entry of its own
+    TCstate_table / TCstate_table_clear
+    - the (cached) table as a dict, re-reading the file after it was updated; clearing also drops the cached blocks,
+      templates, statevectors and operators, which may hold TCstates of the old table
+'''
+TCSTATE_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'TCstate_table.json')
+@lru_cache(maxsize=None)
+def TCstate_table(path=TCSTATE_TABLE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+def TCstate_table_clear():
+    TCstate_table.cache_clear()
+    _TCstate_from_table.cache_clear()
+    # everything built from ancilla-free TCstates
+    for cache in [_cached_block, _TCstate_statevector, cached_circuit_template, HQS_QASM_template, QASM3_template,
+                  _clone_state_operators, _tomography_operators]:
+        cache.cache_clear()
+def TCstate_from_table(m, topology='LNN', path=TCSTATE_TABLE):
+    topology = 'LNN' if (topology in LNN_TOPOLOGIES) else topology
+    qc = _TCstate_from_table(m, topology, path)
+    return qc if (qc is not None or topology == 'LNN') else _TCstate_from_table(m, 'LNN', path)
+@lru_cache(maxsize=None)
+def _TCstate_from_table(m, topology, path):
+    entry = TCstate_table(path).get('{},{}'.format(m, topology))
+    if entry is None:
+        return None
+    qc = TCcircuit(entry['num_qubits'], qreg='qTCstate')
+    for name, qubits, *param in entry['gates']:
+        getattr(qc, name)(*param, *qubits)
+    return qc.freeze()
+
 
 ''' TCstate
     creates TeleCloning State, depending on availability of ancillas:
     - A^(m-1) P C^m: m-1 Ancillas, 1 Port qubits, m Clone qubits
-    - P C^m: 1 Port qubit, m Clone qubits, only for m<=3    
+    - P C^m: 1 Port qubit, m Clone qubits, circuits for m>3 from the lookup table, see TCstate_from_table
     - anc_opt:  Optimizes DSU(m) to SCS(m) on the ancilla+port qubits
                 False   for legacy reasons / backwards compatibility to QCE paper
                 True    for newer Quantinuum experiments 
 '''
-def TCstate(m=2,ancilla=True,topology='LNN',anc_opt=False):
-    qr_TCstate = QuantumRegister(2*m if ancilla else m+1, name='qTCstate')
-    qc_TCstate = QuantumCircuit(qr_TCstate)
+def TCstate(m=2,ancilla=True,topology='LNN',anc_opt=False,IR=False):
+    qc_TCstate = TCcircuit(2*m if ancilla else m+1, qreg='qTCstate')
+
+    # ancilla-free telecloning states beyond m=3 from the lookup table
+    if (not ancilla and m > 3):
+        qc_table = TCstate_from_table(m,topology)
+        assert qc_table is not None, "no telecloning circuit without ancilla known for m={}, see synthesize_TCstate.py".format(m)
+        qc_TCstate.compose(qc_table, inplace=True)
+        return qc_TCstate if IR else qc_TCstate.to_qiskit()
 
     # set input Hamming weight
-    qc_TCstate.compose(inputHW(m,ancilla,topology), inplace=True)
+    qc_TCstate.compose(cached_block('inputHW',m,ancilla,topology,IR=True), inplace=True)
     # feed into dicke state unitary(ies)
     if (ancilla):
         if (anc_opt):
-            qc_TCstate.compose(SCS(m), qubits=[*range(0,m)], inplace=True)
+            qc_TCstate.compose(cached_block('SCS',m,IR=True), qubits=[*range(0,m)], inplace=True)
         else:
-            qc_TCstate.compose(DSU(m), qubits=[*range(0,m)], inplace=True)
-        qc_TCstate.compose(DSU(m), qubits=[*range(2*m-1,m-1,-1)], inplace=True)
+            qc_TCstate.compose(cached_block('DSU',m,IR=True), qubits=[*range(0,m)], inplace=True)
+        qc_TCstate.compose(cached_block('DSU',m,IR=True), qubits=[*range(2*m-1,m-1,-1)], inplace=True)
     else:
-        qc_TCstate.compose(DSU(m), qubits=[*range(1,m+1)], inplace=True)
+        qc_TCstate.compose(cached_block('DSU',m,IR=True), qubits=[*range(1,m+1)], inplace=True)
     
     # return
-    return qc_TCstate
+    return qc_TCstate if IR else qc_TCstate.to_qiskit()
+
+
+''' cached_block
+    Memoized building blocks 'SCS', 'DSU', 'inputHW', 'TCstate', keyed by (m, ancilla, topology, anc_opt)
+    - arguments a block does not depend on are ignored, e.g. cached_block('SCS',3,False) is cached_block('SCS',3)
+    - returns a shared Instruction, compose/append it directly (qc.append(block, qubits)) without copying
+    - IR=True returns the frozen TCcircuit of the block instead, which TCcircuit.compose reads without copying
+    - the Instruction and its .definition are shared between all callers and must never be modified in place
+    - least recently used blocks are evicted once BLOCK_CACHE_SIZE blocks are cached
+    block_cache_info / block_cache_clear
+    - hit/miss counters and current size of the cache, resetting the cache
+'''
+BLOCK_CACHE_SIZE = 256
+def cached_block(block, m=2, ancilla=True, topology='LNN', anc_opt=False, IR=False):
+    topology = 'LNN' if (topology in LNN_TOPOLOGIES) else topology
+    if (block in ['SCS', 'DSU']):
+        qc_block = _cached_block(block, m, True, 'LNN', False)
+    elif (block == 'inputHW'):
+        qc_block = _cached_block(block, m, ancilla, topology, False)
+    elif (block == 'TCstate'):
+        qc_block = _cached_block(block, m, ancilla, topology, anc_opt and ancilla)
+    else:
+        raise ValueError("unknown building block {}".format(block))
+    return qc_block if IR else qc_block.to_instruction('{}{}'.format(block,m))
+@lru_cache(maxsize=BLOCK_CACHE_SIZE)
+def _cached_block(block, m, ancilla, topology, anc_opt):
+    if (block == 'SCS'):
+        qc_block = SCS(m,IR=True)
+    elif (block == 'DSU'):
+        qc_block = DSU(m,IR=True)
+    elif (block == 'inputHW'):
+        qc_block = inputHW(m,ancilla,topology,IR=True)
+    else:
+        qc_block = TCstate(m,ancilla,topology,anc_opt,IR=True)
+    return qc_block.freeze()
+def block_cache_info():
+    return _cached_block.cache_info()
+def block_cache_clear():
+    _cached_block.cache_clear()
 
 
 ''' LOCC
@@ -212,23 +772,21 @@ def TCstate(m=2,ancilla=True,topology='LNN',anc_opt=False):
     - 'dfm':  deferred measurement / quantum operations
     - 'psXZ': postselection to apply X,Z 
     - 'locc': classical feed forward
+
+    log_depth: for 'dfm' on full connectivity, the port fan-out and message fan-in use fanout_tree/fanin_tree,
+               O(log m) instead of O(m) depth with unchanged qubit positions, at the cost of 2m-2 more CX gates;
+               only for m >= LOG_DEPTH_MIN_M = 21, where the trees are shallower, below that the linear fan-out/fan-in is kept
 '''
-def LOCC(m=2,ancilla=True,topology='LNN',locc='dfm', Qiskit_if_statements=True):
+def LOCC(m=2,ancilla=True,topology='LNN',locc='dfm', Qiskit_if_statements=True, IR=False, log_depth=False):
     HQS_QASM = ""
     # circuit
     if (locc == 'locc'):
-        qr_LOCC = QuantumRegister(2*m+1 if ancilla else m+2, name='qLOCC')    
-        cr_LOCC = ClassicalRegister(2*m+1 if ancilla else m+2, name='cLOCC')
-        qc_LOCC = QuantumCircuit(qr_LOCC, cr_LOCC)
+        qc_LOCC = TCcircuit(2*m+1 if ancilla else m+2, 2*m+1 if ancilla else m+2, qreg='qLOCC', creg='cLOCC')
     else:
-        qr_LOCC = QuantumRegister(2*m+1 if ancilla else m+2, name='qLOCC')    
-        qc_LOCC = QuantumCircuit(qr_LOCC)
+        qc_LOCC = TCcircuit(2*m+1 if ancilla else m+2, qreg='qLOCC')
         
     # qubit positions
-    if (ancilla):
-        qpos = {'message': 0, 'ancillas': [*range(1,m)], 'port': m, 'clones': [*range(m+1,2*m+1)]}
-    else:
-        qpos = {'message': 0, 'ancillas': [], 'port': 1, 'clones': [*range(2,m+2)]}
+    qpos = LOCC_qubit_positions(m,ancilla)
     
     # implement locc
     if (locc == 'locc'):
@@ -238,14 +796,14 @@ def LOCC(m=2,ancilla=True,topology='LNN',locc='dfm', Qiskit_if_statements=True):
         qc_LOCC.measure(qpos['port'], qpos['port'])
         for clone in qpos['clones']:
             if Qiskit_if_statements:
-                qc_LOCC.x(clone).c_if(cr_LOCC[qpos['port']], 1)
-                qc_LOCC.z(clone).c_if(cr_LOCC[qpos['message']], 1)         
+                qc_LOCC.x(clone, condition=(qpos['port'], 1))
+                qc_LOCC.z(clone, condition=(qpos['message'], 1))
             else:
                 HQS_QASM += "if(c["+str(qpos['port'])+"]==1) x q["+str(clone)+"];\n"
                 HQS_QASM += "if(c["+str(qpos['message'])+"]==1) z q["+str(clone)+"];\n"
     # implement deferred measurement
     elif (locc == 'dfm'):
-        if (topology == 'LNN'):
+        if (topology in LNN_TOPOLOGIES):
             # bell measurement cnot
             qc_LOCC.cx(qpos['message'], qpos['port']) 
             # port-controlled clone-Xgates, combined with swaps
@@ -258,10 +816,7 @@ def LOCC(m=2,ancilla=True,topology='LNN',locc='dfm', Qiskit_if_statements=True):
             qpos['clones'][0:m-1], qpos['message'] = [qpos['message'],*qpos['clones'][0:m-2]], qpos['clones'][m-2]
             #qc_LOCC.h(qpos['message']) # bell measurement h, not necessary for dfm
         else:
-            qc_LOCC.cx(qpos['message'], qpos['port'])       # bell measurement cnot
-            qc_LOCC.cx([qpos['port']]*m, qpos['clones'])    # port-controlled clone-Xgates
-            qc_LOCC.cx(qpos['clones'], [qpos['message']]*m) # message-controlled clone-Zgates
-            #qc_LOCC.h(qpos['message']) # bell measurement h, not necessary for dfm
+            dfm_full(qc_LOCC, qpos, log_depth and m >= LOG_DEPTH_MIN_M)
 
 
     # implement postselection
@@ -274,7 +829,234 @@ def LOCC(m=2,ancilla=True,topology='LNN',locc='dfm', Qiskit_if_statements=True):
 
     
     # return
-    return qc_LOCC, qpos, HQS_QASM
+    return qc_LOCC if IR else qc_LOCC.to_qiskit(), qpos, HQS_QASM
+
+''' LOCC_qubit_positions
+    dictionary of qubit positions of message, ancillas, port and clones
+    - before LOCC (final=False), i.e. as laid out by message + TCstate
+    - after LOCC (final=True), following the swaps that LOCC(locc='dfm') on 'LNN' merges into its CX gates
+    - computed without building any circuit
+'''
+def LOCC_qubit_positions(m=2,ancilla=True,topology='LNN',locc='dfm',final=False):
+    if (ancilla):
+        qpos = {'message': 0, 'ancillas': [*range(1,m)], 'port': m, 'clones': [*range(m+1,2*m+1)]}
+    else:
+        qpos = {'message': 0, 'ancillas': [], 'port': 1, 'clones': [*range(2,m+2)]}
+    if (final and locc == 'dfm' and topology in LNN_TOPOLOGIES):
+        qpos['clones'], qpos['port'] = [qpos['port'],*qpos['clones'][0:m-1]], qpos['clones'][m-1]
+        qpos['clones'][0:m-1], qpos['message'] = [qpos['message'],*qpos['clones'][0:m-2]], qpos['clones'][m-2]
+    return qpos
+
+''' heavy_hex_layout
+    initial layout placing the circuit of construct_circuit(.., m, ancilla, topology, locc, ..) on a device without SWAPs
+    - searches the coupling map (CouplingMap or edge list) for a port qubit with the message on one neighbor and
+      the ancillas and clones on two disjoint simple paths leaving the port, i.e. the T-shaped 'LNN' coupling graph
+    - on heavy-hex devices (ibmq_montreal, ibmq_toronto, ...) the port lands on a degree 3 qubit
+    - exclude: physical qubits not to be used, e.g. bad qubits or qubits taken by other circuits
+    - returns the list of physical qubits of circuit qubits 0, 1, .., for transpile(.., initial_layout=...),
+      checked with is_native_layout, None if there is no such patch
+    circuit_coupling_edges
+    - set of circuit qubit pairs (sorted tuples) acted on by a two-qubit gate, read off the cached template
+    is_native_layout
+    - True if every two-qubit gate acts on coupled physical qubits under layout, i.e. routing inserts no SWAP
+'''
+def heavy_hex_layout(m, coupling_map, ancilla=True, topology='heavyhex', locc='dfm', exclude=()):
+    neighbors = _coupling_neighbors(coupling_map)
+    qpos = LOCC_qubit_positions(m, ancilla)
+    width = 2*m+1 if ancilla else m+2
+    for port in sorted(neighbors):
+        if (port in exclude):
+            continue
+        for message in sorted(neighbors[port]):
+            if (message in exclude):
+                continue
+            used = {port, message, *exclude}
+            for ancillas in _simple_paths(neighbors, port, len(qpos['ancillas']), used):
+                for clones in _simple_paths(neighbors, port, m, used | set(ancillas)):
+                    layout = [None]*width
+                    layout[qpos['message']], layout[qpos['port']] = message, port
+                    for q, physical in zip([*reversed(qpos['ancillas'])] + qpos['clones'], ancillas + clones):
+                        layout[q] = physical
+                    if is_native_layout(m, coupling_map, layout, ancilla, topology, locc):
+                        return layout
+    return None
+def _coupling_neighbors(coupling_map):
+    edges = coupling_map.get_edges() if hasattr(coupling_map, 'get_edges') else coupling_map
+    neighbors = {}
+    for a, b in edges:
+        neighbors.setdefault(a, set()).add(b)
+        neighbors.setdefault(b, set()).add(a)
+    return neighbors
+def _simple_paths(neighbors, start, length, used):
+    if (length == 0):
+        yield []
+        return
+    for q in sorted(neighbors[start]):
+        if (q not in used):
+            for path in _simple_paths(neighbors, q, length-1, used | {q}):
+                yield [q, *path]
+def circuit_coupling_edges(m, ancilla=True, topology='LNN', locc='dfm', anc_opt=False, log_depth=False):
+    qc = cached_circuit_template(m, ancilla, topology, locc, True, anc_opt, True, log_depth)[0]
+    return {tuple(sorted(q)) for op, q, _, _, _ in qc if len(q) == 2 and op != 'barrier'}
+def is_native_layout(m, coupling_map, layout, ancilla=True, topology='LNN', locc='dfm', anc_opt=False, log_depth=False):
+    neighbors = _coupling_neighbors(coupling_map)
+    return all(layout[b] in neighbors.get(layout[a], ()) for a, b in circuit_coupling_edges(m, ancilla, topology, locc, anc_opt, log_depth))
+
+''' verify_TCstate
+    checks a TeleCloning State candidate qc (QuantumCircuit, TCcircuit or statevector, default TCstate(m,ancilla,topology)):
+    - teleclones the 12 messages on the vertices of an icosahedron with LOCC(locc='dfm'), by statevector simulation
+    - returns the largest deviation of a clone fidelity from the optimal universal 1->m cloning fidelity (2m+1)/(3m)
+    - the clone fidelity is a polynomial of degree 2 in the Bloch vector of the message and the icosahedron is a
+      spherical 5-design, so deviation 0 means optimal for every message, not only on average
+    icosahedron_messages
+    - (ryangles, rzangles) of the 12 messages
+'''
+def icosahedron_messages():
+    g = (1+5**0.5)/2
+    vertices = numpy.array([(0,a,b*g) for a in (1,-1) for b in (1,-1)] + [(a,b*g,0) for a in (1,-1) for b in (1,-1)] + [(b*g,0,a) for a in (1,-1) for b in (1,-1)])
+    vertices /= numpy.linalg.norm(vertices, axis=1)[:, None]
+    return numpy.arccos(vertices[:, 2]), numpy.mod(numpy.arctan2(vertices[:, 1], vertices[:, 0]), 2*numpy.pi)
+def verify_TCstate(m, qc=None, ancilla=False, topology='LNN'):
+    qc = TCstate(m, ancilla, topology, IR=True) if qc is None else qc
+    state = qi.Statevector(qc.to_qiskit() if isinstance(qc, TCcircuit) else qc)
+    qc_LOCC = LOCC(m, ancilla, topology, 'dfm')[0]
+    clones = LOCC_qubit_positions(m, ancilla, topology, 'dfm', final=True)['clones']
+    deviation = 0
+    for message in message_statevectors(*icosahedron_messages()):
+        sv = qi.Statevector(numpy.kron(state.data, message)).evolve(qc_LOCC)
+        for clone in clones:
+            rho = qi.partial_trace(sv, [q for q in range(qc_LOCC.num_qubits) if q != clone]).data
+            deviation = max(deviation, abs(numpy.real(message.conj() @ rho @ message) - (2*m+1)/(3*m)))
+    return float(deviation)
+
+''' TCstate_statevector
+    statevector of TCstate(m, ancilla, topology, anc_opt) in closed form, without simulating its gates
+    - the state is sum_l |phi_l⟩ |D^m_l⟩ over the clone Hamming weights l, with the clones in Dicke states and
+      |phi_l⟩ on the ancillas + port (qubits 0..m-1 of TCstate, only the port without ancillas):
+      ancilla:              |phi_l⟩ = |D^m_l⟩ / sqrt(m+1)
+      ancilla and anc_opt:  |phi_l⟩ = (sqrt((m-l)/m) |1^l 0^(m-1-l)⟩|0⟩ + sqrt(l/m) |1^(l-1) 0^(m-l)⟩|1⟩) / sqrt(m+1),
+                            ancillas in thermometer order from qubit 0, port last
+      no ancilla:           |phi_l⟩ = c_0l |0⟩ + c_1l |1⟩, for m<=3 from inputHW, for m>3 read off the lookup table circuit
+    - the same state for all topologies, real amplitudes
+    - sparse=True returns (indices, amplitudes) of the nonzero amplitudes in increasing index order, C(2m,m) instead of 4^m for ancillas
+    - little_endian=True is the Qiskit qubit order (qubit 0 least significant), False has qubit 0 most significant
+    - memoized, the returned arrays are shared and read-only
+    TCstate_port_states
+    - the states |phi_l⟩ as (indices, amplitudes) for l = 0..m; Dicke_indices(m, l) are the basis states of |D^m_l⟩
+'''
+def TCstate_port_states(m, ancilla=True, topology='LNN', anc_opt=False):
+    if (ancilla):
+        phis = []
+        for l in range(m+1):
+            if (anc_opt):
+                terms = [((1 << l)-1, math.sqrt((m-l)/m)), ((1 << (l-1))-1 + (1 << (m-1)), math.sqrt(l/m))] if l else [(0, 1.0)]
+                phis.append(([i for i, a in terms if a > 0], [a/math.sqrt(m+1) for i, a in terms if a > 0]))
+            else:
+                indices = Dicke_indices(m, l)
+                phis.append((indices, [1/math.sqrt((m+1)*len(indices))]*len(indices)))
+        return phis
+    if (m == 2):
+        c = [[math.sqrt(2/3), 0, 0], [0, math.sqrt(1/3), 0]]
+    elif (m == 3):
+        c = [[math.sqrt(1/2), math.sqrt(1/6), 0, 0], [0, math.sqrt(1/6), math.sqrt(1/6), 0]]
+    else:
+        # Dicke coefficients c_pl = sqrt(C(m,l)) <p|<1^l 0^(m-l)| TCstate⟩
+        state = qi.Statevector(cached_block('TCstate', m, False, topology, IR=True).to_qiskit()).data.real
+        c = [[state[p + (((1 << l)-1) << 1)]*math.sqrt(math.comb(m, l)) for l in range(m+1)] for p in range(2)]
+    return [([p for p in range(2) if abs(c[p][l]) > 1e-12], [c[p][l] for p in range(2) if abs(c[p][l]) > 1e-12]) for l in range(m+1)]
+def Dicke_indices(m, l):
+    return [sum(1 << i for i in bits) for bits in itertools.combinations(range(m), l)]
+def TCstate_statevector(m=2, ancilla=True, topology='LNN', anc_opt=False, sparse=False, little_endian=True):
+    topology = 'LNN' if (topology in LNN_TOPOLOGIES or ancilla or m <= 3) else topology
+    indices, amplitudes = _TCstate_statevector(m, ancilla, topology, anc_opt and ancilla, little_endian)
+    if (sparse):
+        return indices, amplitudes
+    state = numpy.zeros(2**(2*m if ancilla else m+1))
+    state[indices] = amplitudes
+    return state
+@lru_cache(maxsize=None)
+def _TCstate_statevector(m, ancilla, topology, anc_opt, little_endian):
+    port_qubits = m if ancilla else 1
+    indices, amplitudes = [], []
+    for l, (phi_indices, phi_amplitudes) in enumerate(TCstate_port_states(m, ancilla, topology, anc_opt)):
+        clone_indices = numpy.array(Dicke_indices(m, l), dtype=numpy.int64) << port_qubits
+        indices.append((numpy.array(phi_indices, dtype=numpy.int64)[:, None] + clone_indices[None, :]).ravel())
+        amplitudes.append(numpy.repeat(numpy.array(phi_amplitudes)/math.sqrt(len(clone_indices)), len(clone_indices)))
+    indices, amplitudes = numpy.concatenate(indices), numpy.concatenate(amplitudes)
+    if not little_endian:
+        n = port_qubits + m
+        indices = sum(((indices >> q) & 1) << (n-1-q) for q in range(n))
+    order = numpy.argsort(indices)
+    indices, amplitudes = indices[order], amplitudes[order]
+    indices.flags.writeable = amplitudes.flags.writeable = False
+    return indices, amplitudes
+
+''' Equivalence checks, without building unitaries
+    evolve_statevectors(qc, states)
+    - statevectors (columns of states) after a TCcircuit (numpy, TCcircuit.evolve) or a QuantumCircuit (qiskit.quantum_info)
+    verify_equivalent(qc1, qc2, probes=4, seed=0)
+    - unitary equivalence up to a global phase on random product state probes, which detect any other difference with
+      probability 1, at the cost of 'probes' statevector simulations
+    - returns the largest deviation ‖U1|ψ⟩ - e^{iφ} U2|ψ⟩‖ over the probes, with the same phase φ for all probes
+    Dicke_projection(state, clones)
+    - projection of a statevector onto the symmetric subspace of the clone qubits: coefficients [rest, l] of |rest⟩|D^m_l⟩
+      (rest: the other qubits, little endian) and the weight of the state outside the symmetric subspace
+    TCstate_port_density(qc, m, ancilla)
+    - density matrix of port + clones of a TCstate circuit (default TCstate(m, ancilla)) in the basis |p⟩|D^m_l⟩, index (p, l),
+      after tracing out the ancillas; polynomial size 2(m+1), and the weight outside the symmetric subspace
+    - LOCC only acts on message, port and clones, so TCstates with the same port density teleclone identically,
+      e.g. anc_opt=True/False, whose ancilla states differ
+    verify_TCstate_equivalent(m, ancilla, variants)
+    - largest deviation of the port densities of TCstate variants (topology, anc_opt) from the closed form
+      TCstate_statevector (including the weight outside the symmetric subspace), default all topologies and options
+'''
+def evolve_statevectors(qc, states):
+    if isinstance(qc, TCcircuit):
+        return qc.evolve(states)
+    return numpy.stack([qi.Statevector(states[:, k]).evolve(qc).data for k in range(states.shape[1])], axis=1)
+def random_product_states(n, k, seed=0):
+    rng = numpy.random.default_rng(seed)
+    states = numpy.ones((1, k), dtype=complex)
+    for _ in range(n):
+        qubit = rng.normal(size=(2, k)) + 1j*rng.normal(size=(2, k))
+        qubit /= numpy.linalg.norm(qubit, axis=0)
+        states = (qubit[:, None, :]*states[None, :, :]).reshape(-1, k)
+    return states
+def verify_equivalent(qc1, qc2, probes=4, seed=0):
+    assert qc1.num_qubits == qc2.num_qubits, "circuits on different numbers of qubits"
+    states = random_product_states(qc1.num_qubits, probes, seed)
+    out1, out2 = evolve_statevectors(qc1, states), evolve_statevectors(qc2, states)
+    overlap = numpy.vdot(out2[:, 0], out1[:, 0])
+    phase = overlap/abs(overlap) if abs(overlap) > 1e-12 else 1
+    return float(numpy.linalg.norm(out1 - phase*out2, axis=0).max())
+def Dicke_projection(state, clones):
+    n = int(state.size).bit_length()-1
+    rest = [q for q in range(n) if q not in clones]
+    # axes in the order (rest, clones), the reshaped rows are little endian over rest, the columns over clones
+    tensor = numpy.asarray(state).reshape((2,)*n).transpose([n-1-q for q in rest[::-1]] + [n-1-q for q in clones[::-1]])
+    tensor = tensor.reshape(2**len(rest), 2**len(clones))
+    m = len(clones)
+    coefficients = numpy.stack([tensor[:, Dicke_indices(m, l)].sum(axis=1)/math.sqrt(math.comb(m, l)) for l in range(m+1)], axis=1)
+    return coefficients, float(max(0.0, numpy.linalg.norm(tensor)**2 - numpy.linalg.norm(coefficients)**2))
+def TCstate_port_density(qc=None, m=2, ancilla=True):
+    qc = TCstate(m, ancilla, IR=True) if qc is None else qc
+    state = qc.evolve() if isinstance(qc, TCcircuit) else qi.Statevector(qc).data
+    return _port_density(state, m, ancilla)
+def _port_density(state, m, ancilla):
+    port = m-1 if ancilla else 0
+    coefficients, leakage = Dicke_projection(state, [*range(port+1, port+1+m)])
+    # rows: ancillas (qubits 0..m-2) below the port bit
+    coefficients = coefficients.reshape(2, -1, m+1).transpose(1, 0, 2).reshape(-1, 2*(m+1))
+    return coefficients.T @ coefficients.conj(), leakage
+def verify_TCstate_equivalent(m, ancilla=True, variants=None):
+    if variants is None:
+        variants = [(topology, anc_opt) for topology in ['LNN', 'full'] for anc_opt in ([False, True] if ancilla else [False])]
+    reference, _ = _port_density(TCstate_statevector(m, ancilla), m, ancilla)
+    deviation = 0
+    for topology, anc_opt in variants:
+        density, leakage = TCstate_port_density(TCstate(m, ancilla, topology, anc_opt, IR=True), m, ancilla)
+        deviation = max(deviation, numpy.abs(density - reference).max(), leakage)
+    return float(deviation)
 
 ''' construct_circuit
     Main Function for all circuits, with options:
@@ -284,6 +1066,7 @@ def LOCC(m=2,ancilla=True,topology='LNN',locc='dfm', Qiskit_if_statements=True):
     - ancilla:  True/False depending on whether ancilla are allowed for the TCstate
                 must be True if n>3
     - topology: 'LNN'  if linear nearest neighbor between TCstate + edge between message & port
+                'heavyhex' the 'LNN' circuit, for heavy-hex devices with heavy_hex_layout as initial layout
                 'full' otherwise (only used/defined as an ELSE statement to IF 'LNN')
     - locc:     'locc' for local operations and classical (feed-forward) communication (Honeywell only)
                 'dfm'  for deferred measurement / quantum operations
@@ -294,29 +1077,159 @@ def LOCC(m=2,ancilla=True,topology='LNN',locc='dfm', Qiskit_if_statements=True):
     - anc_opt:  Optimizes DSU(m) to SCS(m) on the ancilla+port qubits
                 False   for legacy reasons / backwards compatibility to QCE paper
                 True    for newer Quantinuum experiments 
+    - IR:       True returns the circuit as gate list TCcircuit instead of a Qiskit QuantumCircuit
+    - log_depth: tree-structured O(log m) depth 'dfm' LOCC fan-outs on full connectivity, for m >= LOG_DEPTH_MIN_M (see LOCC)
+    - dynamic:  True writes the 'locc' feed-forward corrections as if_test blocks (dynamic circuits) instead of .c_if,
+                with Qiskit_version_if_statements=True and IR=False, see TCcircuit.to_qiskit
+    - warm_start: True initializes the TCstate qubits from TCstate_statevector instead of its gates (simulators only, IR=False),
+                so that a message state costs only the message rotations and LOCC
+    - deferred: True rewrites the 'locc' feed-forward by the deferred measurement principle (TCcircuit.defer_measurements):
+                controlled gates instead of .c_if, with the measurements of message and port moved to the end into the
+                same classical bits, so that the counts keep their meaning and simulators sample all shots from one
+                final state as for 'dfm' (simulators only, has no effect for the other locc)
+    The angle-independent circuit is built once per variant (see construct_circuit_template) and only the message angles are bound
+'''
+def construct_circuit(ryangle, rzangle, m, ancilla, topology, locc, Qiskit_version_if_statements, anc_opt=False, IR=False, log_depth=False, dynamic=False, warm_start=False, deferred=False):
+    template = cached_circuit_template(m, ancilla, topology, locc, Qiskit_version_if_statements, anc_opt, IR, log_depth, dynamic, warm_start, deferred)
+    return bind_circuit_template(template, ryangle, rzangle)
+
+''' construct_circuit_template
+    Builds the circuit of construct_circuit once, with Qiskit Parameters 'ryangle', 'rzangle' for the message angles
+    - only the message rotation depends on the angles, TCstate and LOCC are angle-independent
+    - returns the same tuple as construct_circuit, with the Parameter pair (ryangle, rzangle) instead of rho
+    - bind_circuit_template / bind_circuit_template_batch turn it into construct_circuit outputs
+    cached_circuit_template
+    - memoized version, the returned template is shared and must not be modified in place
 '''
-def construct_circuit(ryangle, rzangle, m, ancilla, topology, locc, Qiskit_version_if_statements, anc_opt=False):
+def construct_circuit_template(m, ancilla, topology, locc, Qiskit_version_if_statements, anc_opt=False, IR=False, log_depth=False, dynamic=False, warm_start=False, deferred=False):
+    assert not (warm_start and IR), "warm_start initializes a Qiskit circuit, it has no gate list (IR)"
+    assert not (deferred and dynamic), "deferred removes the feed-forward that dynamic writes as if_test blocks"
     # setup circuit
     width = 2*m+1 if ancilla else m+2
-    qc = QuantumCircuit(width, width)
+    qc = TCcircuit(width, width)
     # setup message, TCstate, locc
-    qc_message = message_ry_rz(ryangle, rzangle)
-    rho = qi.DensityMatrix.from_instruction(qc_message)
-    qc_TCstate = TCstate(m,ancilla,topology,anc_opt)
-    qc_LOCC, qpos, HQS_QASM = LOCC(m,ancilla,topology,locc, Qiskit_version_if_statements)
+    ryangle, rzangle = Parameter('ryangle'), Parameter('rzangle')
+    qc_TCstate = cached_block('TCstate',m,ancilla,topology,anc_opt,IR=True)
+    qc_LOCC, qpos, HQS_QASM = LOCC(m,ancilla,topology,locc, Qiskit_version_if_statements, IR=True, log_depth=log_depth)
     # compose circuit
-    qc.compose(qc_message, qubits=[0], inplace=True)
-    qc.compose(qc_TCstate, qubits=[*range(1,width)], inplace=True)
+    qc.ry(ryangle, 0)
+    qc.rz(rzangle, 0)
+    if not warm_start:
+        qc.compose(qc_TCstate, qubits=[*range(1,width)], inplace=True)
     qc.barrier()
-    qc.compose(qc_LOCC, qubits=[*range(0,width)], inplace=True)
+    qc.compose(qc_LOCC, qubits=[*range(0,width)], clbits=[*range(0,qc_LOCC.num_clbits)], inplace=True)
+    if (deferred and locc == 'locc'):
+        qc_deferred, measured = qc.defer_measurements()
+        qc = TCcircuit(width, width)
+        qc.compose(qc_deferred, qubits=[*range(0,width)], inplace=True)
+        for clbit, qubit in sorted(measured.items()):
+            qc.measure(qubit, clbit)
+    if not IR:
+        qc = qc.to_qiskit(dynamic)
+    if warm_start:
+        qc.data.insert(0, CircuitInstruction(Initialize(TCstate_statevector(m,ancilla,topology,anc_opt)), qc.qubits[1:width]))
     
-    # return circuit, clone positions, message density matrix, postselect positions & values (if any)
+    # return circuit, clone positions, message angle parameters, postselect positions & values (if any)
     if (locc[0:2] == 'ps'):
-        return qc, qpos['clones'], rho, {qpos['port']: int(locc[2]), qpos['message']: int(locc[3])}
+        return qc, qpos['clones'], (ryangle, rzangle), {qpos['port']: int(locc[2]), qpos['message']: int(locc[3])}
     if Qiskit_version_if_statements:
-        return qc, qpos['clones'], rho
+        return qc, qpos['clones'], (ryangle, rzangle)
     else:
-        return qc, qpos['clones'], rho, HQS_QASM    
+        return qc, qpos['clones'], (ryangle, rzangle), HQS_QASM
+cached_circuit_template = lru_cache(maxsize=None)(construct_circuit_template)
+
+''' bind_circuit_template
+    Binds the message angles of a template, returns exactly what construct_circuit returns
+    bind_circuit_template_batch
+    - binds whole numpy arrays of angles (broadcast against each other)
+    - returns a list of construct_circuit outputs, in row-major order of the broadcast angle arrays
+'''
+def bind_circuit_template(template, ryangle, rzangle):
+    qc, clone_indices, (p_ry, p_rz), *extra = template
+    qc = qc.assign_parameters({p_ry: ryangle, p_rz: rzangle})
+    return (qc, list(clone_indices), message_density_matrix(ryangle, rzangle), *[deepcopy(e) for e in extra])
+def bind_circuit_template_batch(template, ryangles, rzangles):
+    ryangles, rzangles = numpy.broadcast_arrays(numpy.asarray(ryangles, dtype=float), numpy.asarray(rzangles, dtype=float))
+    return [bind_circuit_template(template, float(ry), float(rz)) for ry, rz in zip(ryangles.ravel(), rzangles.ravel())]
+
+''' Quantinuum hqslib1 programs, without the Qiskit round trip
+    HQS_QASM_template
+    - hqslib1 OpenQASM 2 program of a variant with locc='locc' and HQS_QASM if-statements (Qiskit_version_if_statements=False),
+      written once from the cached gate list and split around the message angles
+    - returns (pieces, clone_indices, tomography), where the program is pieces[0] + ryangle + pieces[1] + rzangle + pieces[2]
+      and tomography[basis] are the measurements of all clones in the 'X', 'Y' or 'Z' basis
+    HQS_QASM_programs
+    - programs of a variant for all message angles (ryangles, rzangles broadcast, row-major) and tomography bases
+    - returns a list of (ryangle, rzangle, basis, program), per message state in the order of bases
+    - same gates as qc.qasm() + HQS_QASM with hqslib1.inc and append_parallel_qubit_tomography_to_Honeywell_QASM,
+      but a plain string concatenation per program
+'''
+TOMOGRAPHY_QASM = {'X': 'h q[{0}];\nmeasure q[{0}] -> c[{0}];\n',
+                   'Y': 'sdg q[{0}];\nh q[{0}];\nmeasure q[{0}] -> c[{0}];\n',
+                   'Z': 'measure q[{0}] -> c[{0}];\n'}
+@lru_cache(maxsize=None)
+def HQS_QASM_template(variant):
+    m, ancilla, topology, locc, _, anc_opt, log_depth = get_variant(variant)
+    qc, clone_indices, _, HQS_QASM = cached_circuit_template(m, ancilla, topology, locc, False, anc_opt, True, log_depth)
+    head, rest = qc.to_qasm('hqslib1.inc').split('{ryangle}')
+    middle, tail = rest.split('{rzangle}')
+    tomography = {basis: ''.join(pattern.format(clone) for clone in clone_indices) for basis, pattern in TOMOGRAPHY_QASM.items()}
+    return (head, middle, tail + HQS_QASM), tuple(clone_indices), tomography
+def HQS_QASM_programs(variant, ryangles, rzangles, bases=('Y', 'X', 'Z')):
+    (head, middle, tail), _, tomography = HQS_QASM_template(variant if isinstance(variant, str) else tuple(variant))
+    ryangles, rzangles = numpy.broadcast_arrays(numpy.asarray(ryangles, dtype=float), numpy.asarray(rzangles, dtype=float))
+    programs = []
+    for ryangle, rzangle in zip(ryangles.ravel().tolist(), rzangles.ravel().tolist()):
+        program = head + repr(ryangle) + middle + repr(rzangle) + tail
+        programs += [(ryangle, rzangle, basis, program + tomography[basis]) for basis in bases]
+    return programs
+
+''' Dynamic circuits (OpenQASM 3), for feed-forward on any backend with mid-circuit measurements and if blocks
+    QASM3_template
+    - OpenQASM 3 program of a variant with locc='locc', with the message angles as inputs ryangle, rzangle
+    - the corrections become one if block per measured bit, see TCcircuit.conditional_blocks
+    - returns (program, clone_indices); tomography is appended as in HQS_QASM_programs, with 'c[i] = measure q[i];'
+    LOCC_latency
+    - measurement-to-correction latency of the LOCC stage, to compare feed-forward ('locc') with deferred measurement ('dfm')
+    - the LOCC gate list is scheduled as soon as possible with durations[gate name] (1 per gate by default, i.e. in layers),
+      a conditioned gate starts feed_forward after the measurement of its condition bit has ended
+    - the Bell measurement is the leading run of gates acting on the message and port qubits only, up to the first gate
+      on a clone or ancilla (the CX, H and measurements for 'locc', the CX for 'dfm', CX+H for 'psXZ')
+    - returns {'measured': end of the Bell measurement,
+               'corrected': end of the last clone correction, 'latency': corrected - measured,
+               'blocks': number of if blocks of the corrections (0 without feed-forward)}
+'''
+@lru_cache(maxsize=None)
+def QASM3_template(variant):
+    m, ancilla, topology, locc, _, anc_opt, log_depth = get_variant(variant)
+    qc, clone_indices, _ = cached_circuit_template(m, ancilla, topology, locc, True, anc_opt, True, log_depth)
+    return qc.to_qasm3(), tuple(clone_indices)
+def LOCC_latency(m, ancilla=True, topology='LNN', locc='dfm', durations=None, feed_forward=0, log_depth=False):
+    durations = {} if durations is None else durations
+    qc = LOCC(m, ancilla, topology, locc, True, IR=True, log_depth=log_depth)[0]
+    qpos = LOCC_qubit_positions(m, ancilla)
+    bell_wires = {qpos['message'], qpos['port']}
+    bell = True
+    ready = [0]*(qc.num_qubits + qc.num_clbits)
+    measured = corrected = 0
+    for name, q, c, _, cond in qc:
+        wires = [*q, *[qc.num_qubits+j for j in c]]
+        start = max(ready[w] for w in wires)
+        if cond is not None:
+            start = max(start, ready[qc.num_qubits+cond[0]] + feed_forward)
+        end = start + (0 if name == 'barrier' else durations.get(name, 1))
+        for w in wires:
+            ready[w] = end
+        # the Bell measurement is the leading run of gates on message and port only
+        bell = bell and cond is None and set(q) <= bell_wires
+        if (bell):
+            measured = max(measured, end)
+        else:
+            corrected = max(corrected, end)
+    corrected = max(corrected, measured)
+    return {'measured': measured, 'corrected': corrected, 'latency': corrected - measured,
+            'blocks': sum(cond is not None for cond, _ in qc.conditional_blocks())}
+
 
 ''' IBM
     - 2 clones
@@ -413,3 +1326,591 @@ def construct_PCCC_Honeywell_QASM_circuit_Qiskit_version(ryangle, rzangle, Qiski
 def construct_AAPCCC_Honeywell_QASM_circuit_Qiskit_version(ryangle, rzangle, Qiskit_version_if_statements):
     return construct_circuit(ryangle, rzangle, m=3, ancilla=True, topology='full', locc='locc', Qiskit_version_if_statements=Qiskit_version_if_statements)
 
+
+''' Variant registry
+    TCvariant describes a telecloning circuit variant by the arguments of construct_circuit
+    VARIANTS maps the names of the construct_* functions above (without 'construct_') to their TCvariant,
+    i.e. construct_variant_circuit('PCC_postselect_00', ryangle, rzangle) == construct_PCC_postselect_00(ryangle, rzangle)
+    - other variants can be passed as TCvariant directly, e.g. VARIANTS[name]._replace(Qiskit_version_if_statements=False)
+'''
+TCvariant = namedtuple('TCvariant', ['m', 'ancilla', 'topology', 'locc', 'Qiskit_version_if_statements', 'anc_opt', 'log_depth'], defaults=[True, False, False])
+VARIANTS = {}
+for _m, _ancilla, _layout in [(2, False, 'PCC'), (2, True, 'APCC'), (3, False, 'PCCC'), (3, True, 'AAPCCC')]:
+    VARIANTS['deferred_measurement_'+_layout] = TCvariant(_m, _ancilla, 'LNN', 'dfm')
+    for _ps in ['00', '01', '10', '11']:
+        VARIANTS[_layout+'_postselect_'+_ps] = TCvariant(_m, _ancilla, 'LNN', 'ps'+_ps)
+    VARIANTS[_layout+'_Honeywell_QASM_circuit_Qiskit_version'] = TCvariant(_m, _ancilla, 'full', 'locc')
+def get_variant(variant):
+    return VARIANTS[variant] if isinstance(variant, str) else TCvariant(*variant)
+
+''' variant_metadata
+    metadata of a variant, without building the circuit:
+    - name: qubit layout, e.g. 'AAPCCC' for A^(m-1) P C^m
+    - width: number of qubits (and classical bits) of construct_circuit
+    - clone_indices: clone positions, as returned by construct_circuit
+    - post_select_indices: {qubit: value} postselection map as returned by construct_circuit, None if not postselecting
+    - qpos: positions of message, ancillas, port and clones after LOCC
+'''
+def variant_metadata(variant):
+    m, ancilla, topology, locc = get_variant(variant)[0:4]
+    qpos = LOCC_qubit_positions(m, ancilla, topology, locc, final=True)
+    return {'name': 'A'*(m-1)*ancilla + 'P' + 'C'*m,
+            'width': 2*m+1 if ancilla else m+2,
+            'clone_indices': [*qpos['clones']],
+            'post_select_indices': {qpos['port']: int(locc[2]), qpos['message']: int(locc[3])} if (locc[0:2] == 'ps') else None,
+            'qpos': qpos}
+
+''' construct_variant
+    builds a variant for a batch of message states, ryangles and rzangles are numpy arrays (broadcast against each other)
+    - returns the list of construct_circuit outputs, in row-major order of the broadcast angle arrays
+    construct_variant_circuit
+    - single message state, returns the construct_circuit output
+    - warm_start=True starts from TCstate_statevector instead of the TCstate gates, see construct_circuit
+    - deferred=True simulates 'locc' feed-forward as deferred measurement, see construct_circuit
+'''
+def _variant_template(variant, IR, warm_start=False, deferred=False):
+    m, ancilla, topology, locc, Qiskit_version_if_statements, anc_opt, log_depth = get_variant(variant)
+    return cached_circuit_template(m, ancilla, topology, locc, Qiskit_version_if_statements, anc_opt, IR, log_depth, False, warm_start, deferred)
+def construct_variant(variant, ryangles, rzangles, IR=False, warm_start=False, deferred=False):
+    template = _variant_template(variant, IR, warm_start, deferred)
+    return bind_circuit_template_batch(template, ryangles, rzangles)
+def construct_variant_circuit(variant, ryangle, rzangle, IR=False, warm_start=False, deferred=False):
+    template = _variant_template(variant, IR, warm_start, deferred)
+    return bind_circuit_template(template, ryangle, rzangle)
+
+''' Batched exact clone states over message angle grids
+    clone_state_operators
+    - the angle-independent part of a variant: its output state is A|ψ⟩ for the message |ψ⟩, where the 2 columns of A are
+      LOCC applied to |0⟩,|1⟩ ⊗ TCstate (from TCstate_statevector, so only the LOCC gates are simulated, with
+      'locc' feed-forward deferred, see TCcircuit.defer_measurements, and postselection as a projection)
+    - returns R[k, a, b] (2x2) per clone k (in the order of the clone indices), with ρ_k(ψ) = sum_ab ψ_a ψ_b* R[k, a, b]
+      unnormalized for postselecting variants; memoized, the array is shared and read-only
+    exact_clone_states
+    - exact clone density matrices for all messages at once (ryangles, rzangles broadcast, row-major), no shots
+    - returns (rhos (N, m, 2, 2), fidelities (N, m), probabilities (N,)), probabilities of postselection (1 otherwise)
+'''
+def clone_state_operators(variant):
+    return _clone_state_operators(get_variant(variant)._replace(Qiskit_version_if_statements=True))
+# the map A of message states to output states (2**width, 2), with 'locc' deferred; the measured qubits then hold the
+# classical bits of the feed-forward; memoized and read-only
+@lru_cache(maxsize=None)
+def _variant_output_map(variant):
+    m, ancilla, topology, locc, _, anc_opt, log_depth = variant
+    qc_LOCC = LOCC(m, ancilla, topology, locc, True, IR=True, log_depth=log_depth)[0]
+    measured = []
+    if (locc == 'locc'):
+        qc_LOCC, deferred = qc_LOCC.defer_measurements()
+        measured = sorted(deferred.values())
+    width = qc_LOCC.num_qubits
+    inputs = numpy.zeros((2**width, 2))
+    inputs[0::2, 0] = inputs[1::2, 1] = TCstate_statevector(m, ancilla, topology, anc_opt)
+    A = qc_LOCC.evolve(inputs)
+    A.flags.writeable = False
+    return A, measured
+@lru_cache(maxsize=None)
+def _clone_state_operators(variant):
+    A = _variant_output_map(variant)[0].copy()
+    width = int(A.shape[0]).bit_length()-1
+    metadata = variant_metadata(variant)
+    if (metadata['post_select_indices'] is not None):
+        indices = numpy.arange(2**width)
+        for q, value in metadata['post_select_indices'].items():
+            A[((indices >> q) & 1) != value] = 0
+    A = A.reshape((2,)*width + (2,))
+    R = numpy.stack([numpy.einsum('ira,jrb->abij', B, B.conj()) for B in
+                     (numpy.moveaxis(A, width-1-clone, 0).reshape(2, -1, 2) for clone in metadata['clone_indices'])])
+    R.flags.writeable = False
+    return R
+def exact_clone_states(variant, ryangles, rzangles):
+    R = clone_state_operators(variant)
+    psi = message_statevectors(ryangles, rzangles).reshape(-1, 2)
+    rhos = numpy.einsum('na,nb,kabij->nkij', psi, psi.conj(), R)
+    probabilities = numpy.real(numpy.trace(rhos[:, 0], axis1=1, axis2=2))
+    rhos /= probabilities[:, None, None, None]
+    fidelities = numpy.real(numpy.einsum('ni,nkij,nj->nk', psi.conj(), rhos, psi))
+    return rhos, fidelities, probabilities
+
+''' Shot-noise emulation without Aer
+    tomography_probabilities(variant, ryangles, rzangles, bases=('Y','X','Z'))
+    - exact outcome probabilities of the tomography circuits of parallel_qubit_state_tomography_general (clone i measured
+      into clbit i), including the measured postselection qubits (add_measurements_for_postselect_circuits) and, for
+      'locc', the feed-forward bits; same angle-independent map as clone_state_operators
+    - returns (P (N, len(bases), 2**k), measured qubits (k,)), outcome index little endian over the measured qubits
+    sample_counts(probabilities, shots, seed=None)
+    - multinomial counts of all circuits in one vectorized draw, integer array of the shape of probabilities
+    counts_dictionaries(counts, measured, width)
+    - the counts of one circuit (2**k,) in the format of result.get_counts(): {bitstring: count} with width clbits, only
+      nonzero counts, as read by get_single_qubit_measurements_from_parallel_results (_with_postselection)
+    emulate_tomography_counts(variant, ryangles, rzangles, shots, seed=None, bases=('Y','X','Z'))
+    - one {basis: counts dictionary} per message state (row-major over the angles), in place of
+      result.get_counts(basis+"_"+str(angle_ry)+"_"+str(angle_rz)) of an Aer run with shots shots
+    tomography_marginals(counts, clone_indices, post_select_indices=None)
+    - such a list of {basis: counts} (from any engine) as single clone outcome counts (N, m, 3, 2) in the X, Y, Z bases,
+      keeping only the shots with the postselected values, as get_single_qubit_measurements_from_parallel_results
+      (_with_postselection); marginals of several postselection outcomes add up, as merge_dictionaries in the scripts
+    tomography_clone_states(marginals)
+    - clone density matrices (N, m, 2, 2) by linear inversion, Bloch vectors longer than 1 scaled back onto the sphere:
+      for one qubit this is the positive semidefinite projection of StateTomographyFitter.fit(method='lstsq')
+'''
+TOMOGRAPHY_ROTATIONS = {'Z': numpy.eye(2), 'X': numpy.array(_IR_GATE_MATRICES[4]),
+                        'Y': numpy.array(_IR_GATE_MATRICES[4]) @ _IR_GATE_MATRICES[5]}
+def tomography_probabilities(variant, ryangles, rzangles, bases=('Y', 'X', 'Z')):
+    M, measured = _tomography_operators(get_variant(variant)._replace(Qiskit_version_if_statements=True), tuple(bases))
+    psi = message_statevectors(ryangles, rzangles).reshape(-1, 2)
+    return numpy.clip(numpy.real(numpy.einsum('na,nb,kyab->nky', psi, psi.conj(), M)), 0, None), measured
+@lru_cache(maxsize=None)
+def _tomography_operators(variant, bases):
+    A, measured = _variant_output_map(variant)
+    metadata = variant_metadata(variant)
+    measured = sorted(set(measured) | set(metadata['clone_indices']) | set(metadata['post_select_indices'] or {}))
+    width = int(A.shape[0]).bit_length()-1
+    M = []
+    for basis in bases:
+        B = _measured_first(_rotate_clones(A.reshape((2,)*width + (2,)), width, metadata['clone_indices'], basis), width, measured)
+        M.append(numpy.einsum('yra,yrb->yab', B, B.conj()))
+    M = numpy.array(M)
+    M.flags.writeable = False
+    return M, measured
+# basis changes of the clones on a statevector tensor (axis width-1-q is qubit q, further axes are kept)
+def _rotate_clones(tensor, width, clones, basis):
+    for clone in clones:
+        tensor = numpy.moveaxis(numpy.tensordot(TOMOGRAPHY_ROTATIONS[basis], tensor, axes=([1], [width-1-clone])), 0, width-1-clone)
+    return tensor
+# measured axes first, highest qubit first, so that the outcome index is little endian: shape (2**k, rest, further axes)
+def _measured_first(tensor, width, measured):
+    axes = [width-1-q for q in measured[::-1]]
+    tensor = tensor.transpose(axes + [i for i in range(tensor.ndim) if i not in axes])
+    return tensor.reshape((2**len(measured), 2**(width-len(measured))) + tensor.shape[width:])
+def sample_counts(probabilities, shots, seed=None):
+    probabilities = numpy.asarray(probabilities)
+    probabilities = probabilities/probabilities.sum(axis=-1, keepdims=True)
+    return numpy.random.default_rng(seed).multinomial(shots, probabilities)
+def counts_dictionaries(counts, measured, width):
+    keys = []
+    for y in range(len(counts)):
+        bits = ['0']*width
+        for i, q in enumerate(measured):
+            bits[width-1-q] = str((y >> i) & 1)
+        keys.append(''.join(bits))
+    return {keys[y]: int(c) for y, c in enumerate(counts) if c}
+def emulate_tomography_counts(variant, ryangles, rzangles, shots, seed=None, bases=('Y', 'X', 'Z')):
+    probabilities, measured = tomography_probabilities(variant, ryangles, rzangles, bases)
+    counts = sample_counts(probabilities, shots, seed)
+    width = variant_metadata(variant)['width']
+    return [{basis: counts_dictionaries(c, measured, width) for basis, c in zip(bases, circuits)} for circuits in counts]
+def tomography_marginals(counts, clone_indices, post_select_indices=None):
+    marginals = numpy.zeros((len(counts), len(clone_indices), 3, 2))
+    for n, circuits in enumerate(counts):
+        for b, basis in enumerate('XYZ'):
+            for bitstring, count in circuits[basis].items():
+                bits = bitstring.replace(' ', '')[::-1]
+                if all(bits[q] == str(value) for q, value in (post_select_indices or {}).items()):
+                    for k, clone in enumerate(clone_indices):
+                        marginals[n, k, b, int(bits[clone])] += count
+    return marginals
+def tomography_clone_states(marginals):
+    bloch = (marginals[..., 0] - marginals[..., 1])/numpy.maximum(marginals.sum(axis=-1), 1)
+    bloch /= numpy.maximum(numpy.linalg.norm(bloch, axis=-1, keepdims=True), 1)
+    return 0.5*(numpy.eye(2) + numpy.einsum('...p,pij->...ij', bloch, _PAULI_MATRICES))
+_PAULI_MATRICES = numpy.array([[[0, 1], [1, 0]], [[0, -1j], [1j, 0]], [[1, 0], [0, -1]]])
+
+''' Shared-prefix tomography
+    shared_prefix_tomography(qc, clone_indices, shots, post_select_indices=None, bases=('Y','X','Z'), seed=None)
+    - counts of the tomography circuits of a bound circuit (TCcircuit, e.g. construct_circuit(..., IR=True), or a
+      QuantumCircuit without measurements), which only differ in their last basis change layer: the circuit is
+      evolved once, the basis changes are applied to the cached statevector and the shots sampled from it
+    - 'locc' feed-forward is deferred (TCcircuit.defer_measurements), its measured qubits are part of the outcomes, as
+      are the postselection qubits; returns {basis: counts dictionary} as emulate_tomography_counts
+    shared_prefix_tomography_sweep(variant, ryangles, rzangles, shots, seed=None, bases=('Y','X','Z'))
+    - gate level alternative to emulate_tomography_counts, one statevector simulation per message state
+'''
+def shared_prefix_tomography(qc, clone_indices, shots, post_select_indices=None, bases=('Y', 'X', 'Z'), seed=None):
+    if isinstance(qc, TCcircuit):
+        qc, measured = qc.defer_measurements()
+        state = qc.evolve()
+    else:
+        measured = {}
+        state = qi.Statevector(qc).data
+    width = qc.num_qubits
+    measured = sorted(set(measured.values()) | set(clone_indices) | set(post_select_indices or {}))
+    rng = numpy.random.default_rng(seed)
+    counts = {}
+    for basis in bases:
+        amplitudes = _measured_first(_rotate_clones(state.reshape((2,)*width), width, clone_indices, basis), width, measured)
+        probabilities = numpy.sum(numpy.abs(amplitudes)**2, axis=1)
+        counts[basis] = counts_dictionaries(rng.multinomial(shots, probabilities/probabilities.sum()), measured, width)
+    return counts
+def shared_prefix_tomography_sweep(variant, ryangles, rzangles, shots, seed=None, bases=('Y', 'X', 'Z')):
+    rng = numpy.random.default_rng(seed)
+    return [shared_prefix_tomography(qc, clone_indices, shots, extra[0] if extra else None, bases, rng)
+            for qc, clone_indices, _, *extra in construct_variant(variant, ryangles, rzangles, IR=True)]
+
+''' Single-job Aer sweeps
+    tomography_circuit_templates(variant, bases=('Y','X','Z'))
+    - the tomography circuits of parallel_qubit_state_tomography_general (plus the postselection measurements) on the
+      circuit template, with the message angles as Parameters and 'locc' feed-forward deferred (construct_circuit with
+      deferred=True); returns (circuits, (ryangle, rzangle))
+    run_tomography_sweep(backend, variant, ryangles, rzangles, shots, bases=('Y','X','Z'), transpile_options=None, **options)
+    - runs all message states in one backend.run with parameter_binds (no transpilation unless transpile_options are
+      given, e.g. a coupling map and layout for a device noise model; the templates only use gates supported by the Aer
+      simulators), with max_parallel_experiments=0 and max_parallel_shots=0 (all cores) unless given in options, and
+      splits the experiments (circuit-major, then binds) back per angle and basis
+    - returns the same list of {basis: counts} per message state as emulate_tomography_counts
+    tomography_counts_by_name(counts, ryangles, rzangles)
+    - such a list as {circuit name: counts}, with the circuit names of parallel_qubit_state_tomography_general,
+      i.e. basis+"_"+str(angle_ry)+"_"+str(angle_rz), for the get_counts calls of the local scripts
+'''
+def tomography_circuit_templates(variant, bases=('Y', 'X', 'Z')):
+    m, ancilla, topology, locc, Qiskit_version_if_statements, anc_opt, log_depth = get_variant(variant)
+    qc, clone_indices, parameters, *extra = cached_circuit_template(m, ancilla, topology, locc, Qiskit_version_if_statements, anc_opt, False, log_depth, False, False, True)
+    post_select_indices = extra[0] if (locc[0:2] == 'ps') else {}
+    circuits = []
+    for basis in bases:
+        circuit = qc.copy(basis)
+        circuit.barrier()
+        for idx in clone_indices:
+            if (basis == 'Y'):
+                circuit.sdg(idx)
+            if (basis in ['X', 'Y']):
+                circuit.h(idx)
+        circuit.barrier()
+        for idx in clone_indices:
+            circuit.measure(idx, idx)
+        for idx in post_select_indices:
+            circuit.measure(idx, idx)
+        circuits.append(circuit)
+    return circuits, parameters
+def run_tomography_sweep(backend, variant, ryangles, rzangles, shots, bases=('Y', 'X', 'Z'), transpile_options=None, **options):
+    circuits, (ryangle, rzangle) = tomography_circuit_templates(variant, bases)
+    if transpile_options:
+        circuits = transpile(circuits, **transpile_options)
+    ryangles, rzangles = numpy.broadcast_arrays(numpy.asarray(ryangles, dtype=float), numpy.asarray(rzangles, dtype=float))
+    binds = {ryangle: [float(angle) for angle in ryangles.ravel()], rzangle: [float(angle) for angle in rzangles.ravel()]}
+    options = {'max_parallel_experiments': 0, 'max_parallel_shots': 0, **options}
+    result = backend.run(circuits, shots=shots, parameter_binds=[binds]*len(circuits), **options).result()
+    N = ryangles.size
+    return [{basis: result.get_counts(b*N + n) for b, basis in enumerate(bases)} for n in range(N)]
+def tomography_counts_by_name(counts, ryangles, rzangles):
+    ryangles, rzangles = numpy.broadcast_arrays(numpy.asarray(ryangles, dtype=float), numpy.asarray(rzangles, dtype=float))
+    return {basis+"_"+str(float(ry))+"_"+str(float(rz)): basis_counts
+            for circuit_counts, ry, rz in zip(counts, ryangles.ravel(), rzangles.ravel()) for basis, basis_counts in circuit_counts.items()}
+
+''' Symmetric-subspace (Dicke basis) simulation for large m
+    TCstate_Dicke_amplitudes
+    - the telecloning state as array T[w, p, l] of the basis states |w⟩|p⟩|D^m_l⟩ (ancillas, port, clones), where w labels
+      orthonormal ancilla states: |D^(m-1)_w⟩ for anc_opt=False, thermometer states for anc_opt=True (same amplitudes),
+      a single one without ancillas; see TCstate_statevector
+    symmetric_clone_operators
+    - clone_state_operators with O(m^2) instead of O(4^m) cost: message and port are qubits, ancillas and clones are kept
+      as weight indices, on which LOCC only acts by X^⊗m (|D_l⟩ -> |D_(m-l)⟩) and Z^⊗m ((-1)^l on |D_l⟩)
+    - 'dfm' and 'locc' give the same clone states and are simulated as Bell measurement plus deferred corrections,
+      'psXZ' as projection; the topology only moves the clones and does not change their states
+    - amplitudes: any other state T[w, p, l] instead of the telecloning state (e.g. a perturbed one)
+    - all clones are in the same state, returns R[a, b] (2x2) with ρ(ψ) = sum_ab ψ_a ψ_b* R[a, b]
+    symmetric_clone_states
+    - exact_clone_states for the (identical) clones: (rhos (N, 2, 2), fidelities (N,), probabilities (N,)),
+      e.g. m=100 clones in milliseconds
+'''
+def TCstate_Dicke_amplitudes(m, ancilla=True, topology='LNN'):
+    if (ancilla):
+        T = numpy.zeros((m, 2, m+1))
+        l = numpy.arange(m+1)
+        T[l[:m], 0, l[:m]] = numpy.sqrt((m-l[:m])/m)
+        T[l[1:]-1, 1, l[1:]] = numpy.sqrt(l[1:]/m)
+        return T/math.sqrt(m+1)
+    T = numpy.zeros((1, 2, m+1))
+    for l, (indices, amplitudes) in enumerate(TCstate_port_states(m, False, topology)):
+        T[0, indices, l] = amplitudes
+    return T
+def symmetric_clone_operators(m, ancilla=True, locc='dfm', amplitudes=None, topology='LNN'):
+    T = TCstate_Dicke_amplitudes(m, ancilla, topology) if amplitudes is None else numpy.asarray(amplitudes)
+    # psi[a, message, w, port, l] for the message input |a⟩
+    psi = numpy.zeros((2, 2) + T.shape, dtype=complex)
+    psi[0, 0] = psi[1, 1] = T
+    # Bell measurement: CX message -> port, H message
+    psi[:, 1] = psi[:, 1, :, ::-1].copy()
+    psi = numpy.stack([psi[:, 0]+psi[:, 1], psi[:, 0]-psi[:, 1]], axis=1)/math.sqrt(2)
+    signs = (-1.0)**numpy.arange(m+1)
+    if (locc in ['dfm', 'locc']):
+        psi[:, :, :, 1] = psi[:, :, :, 1, ::-1].copy()
+        psi[:, 1] *= signs
+    else:
+        psi[:, 1-int(locc[3])] = 0
+        psi[:, :, :, 1-int(locc[2])] = 0
+        if (locc[2] == '1'): psi = psi[..., ::-1]
+        if (locc[3] == '1'): psi = psi*signs
+    d = numpy.einsum('amwpl,bmwpl->abl', psi, psi.conj())
+    e = numpy.einsum('amwpl,bmwpl->abl', psi[..., :-1], psi[..., 1:].conj())
+    l = numpy.arange(m+1)
+    R = numpy.zeros((2, 2, 2, 2), dtype=complex)
+    R[:, :, 0, 0] = d @ ((m-l)/m)
+    R[:, :, 1, 1] = d @ (l/m)
+    R[:, :, 0, 1] = e @ (numpy.sqrt((m-l[:-1])*(l[:-1]+1))/m)
+    R[:, :, 1, 0] = R[:, :, 0, 1].conj().T
+    return R
+def symmetric_clone_states(m, ryangles, rzangles, ancilla=True, locc='dfm', amplitudes=None, topology='LNN'):
+    R = symmetric_clone_operators(m, ancilla, locc, amplitudes, topology)
+    psi = message_statevectors(ryangles, rzangles).reshape(-1, 2)
+    rhos = numpy.einsum('na,nb,abij->nij', psi, psi.conj(), R)
+    probabilities = numpy.real(numpy.trace(rhos, axis1=1, axis2=2))
+    rhos /= probabilities[:, None, None]
+    fidelities = numpy.real(numpy.einsum('ni,nij,nj->n', psi.conj(), rhos, psi))
+    return rhos, fidelities, probabilities
+
+''' Matrix product state (MPS) simulation
+    mps_evolve(qc, tensors=None, max_bond=None, cutoff=1e-12)
+    - applies a TCcircuit (gate list without measurements and conditions, parameters bound) to an MPS with one tensor
+      [left bond, qubit, right bond] per qubit, in qubit order; default input |0...0⟩, see mps_product_state
+    - CX on non-adjacent qubits are routed by SWAPs and back, so the 'LNN' variants (nearest-neighbor CX only) are the cheap ones
+    - after each two-qubit gate the singular values below cutoff (relative to the largest) and beyond max_bond are dropped
+    - returns (tensors, truncation error: the sum of the dropped squared singular values relative to the norm, largest bond)
+    mps_product_state(n, open_message=False)
+    - |0...0⟩, with open_message=True qubit 0 is left open as an input index (the left bond of dimension 2), so that
+      the MPS represents the linear map A of the message state, as in clone_state_operators
+    mps_clone_operators(variant, max_bond=None, cutoff=1e-12)
+    - clone_state_operators from the MPS of the whole circuit (TCstate and LOCC gates, 'locc' deferred), with
+      O(m chi^3) instead of O(2^(2m)) cost for bond dimension chi; returns (R, truncation error, largest bond)
+    mps_clone_states(variant, ryangles, rzangles, max_bond=None, cutoff=1e-12)
+    - exact_clone_states with MPS, returns (rhos, fidelities, probabilities, truncation error)
+    see classical_simulation_code/benchmark_MPS.py for a comparison with the statevector as m grows
+'''
+def mps_product_state(n, open_message=False):
+    tensors = [numpy.array([1.0, 0.0]).reshape(1, 2, 1) for _ in range(n)]
+    if open_message:
+        tensors[0] = numpy.eye(2).reshape(2, 2, 1)
+    return tensors
+def _mps_move_center(tensors, center, target):
+    while (center < target):
+        a, _, b = tensors[center].shape
+        Q, R = numpy.linalg.qr(tensors[center].reshape(2*a, b))
+        tensors[center] = Q.reshape(a, 2, -1)
+        tensors[center+1] = numpy.einsum('ab,bsc->asc', R, tensors[center+1])
+        center += 1
+    while (center > target):
+        a, _, b = tensors[center].shape
+        Q, R = numpy.linalg.qr(tensors[center].reshape(a, 2*b).T)
+        tensors[center] = Q.T.reshape(-1, 2, b)
+        tensors[center-1] = numpy.einsum('asb,bc->asc', tensors[center-1], R.T)
+        center -= 1
+    return center
+_MPS_CX = numpy.zeros((2, 2, 2, 2))
+for _c, _t in itertools.product(range(2), range(2)):
+    _MPS_CX[_c, _t ^ _c, _c, _t] = 1
+_MPS_SWAP = numpy.einsum('ac,bd->abdc', numpy.eye(2), numpy.eye(2))
+def _mps_two_site(tensors, i, gate, max_bond, cutoff):
+    a, b = tensors[i].shape[0], tensors[i+1].shape[2]
+    theta = numpy.einsum('uvst,asb,btc->auvc', gate, tensors[i], tensors[i+1]).reshape(2*a, 2*b)
+    U, S, Vh = numpy.linalg.svd(theta, full_matrices=False)
+    weight = numpy.sum(S**2)
+    keep = max(1, int(numpy.sum(S > cutoff*S[0])))
+    if max_bond is not None:
+        keep = min(keep, max_bond)
+    tensors[i] = U[:, :keep].reshape(a, 2, keep)
+    tensors[i+1] = (S[:keep, None]*Vh[:keep]).reshape(keep, 2, b)
+    return float(numpy.sum(S[keep:]**2)/weight) if weight > 0 else 0.0
+def mps_evolve(qc, tensors=None, max_bond=None, cutoff=1e-12):
+    tensors = mps_product_state(qc.num_qubits) if tensors is None else [numpy.array(t) for t in tensors]
+    center, error = _mps_move_center(tensors, len(tensors)-1, 0), 0.0
+    for op, q, p, cond in zip(qc.opcodes, qc.qargs, qc.params, qc.conditions):
+        if (op == 7 or cond is not None):
+            raise ValueError("mps_evolve simulates gate lists without measurements and classical conditions only")
+        if (op == 8):
+            continue
+        if (op != 6):
+            if (op == 0):
+                c, s = math.cos(float(p)/2), math.sin(float(p)/2)
+                gate = numpy.array([[c, -s], [s, c]])
+            elif (op == 1):
+                gate = numpy.diag([numpy.exp(-0.5j*float(p)), numpy.exp(0.5j*float(p))])
+            else:
+                gate = numpy.array(_IR_GATE_MATRICES[op])
+            tensors[q[0]] = numpy.einsum('us,asb->aub', gate, tensors[q[0]])
+            continue
+        control, target = q
+        step = 1 if (target > control) else -1
+        path = [(i, i+step) for i in range(control, target-step, step)]
+        for i, j in path:
+            center = _mps_move_center(tensors, center, min(i, j))
+            error += _mps_two_site(tensors, min(i, j), _MPS_SWAP, max_bond, cutoff)
+        i = target-step
+        center = _mps_move_center(tensors, center, min(i, target))
+        gate = _MPS_CX if (i < target) else _MPS_CX.transpose(1, 0, 3, 2)
+        error += _mps_two_site(tensors, min(i, target), gate, max_bond, cutoff)
+        for i, j in path[::-1]:
+            center = _mps_move_center(tensors, center, min(i, j))
+            error += _mps_two_site(tensors, min(i, j), _MPS_SWAP, max_bond, cutoff)
+    return tensors, error, max(t.shape[2] for t in tensors)
+def _mps_circuit(variant):
+    m, ancilla, topology, locc, _, anc_opt, log_depth = get_variant(variant)
+    qc_LOCC = LOCC(m, ancilla, topology, locc, True, IR=True, log_depth=log_depth)[0]
+    if (locc == 'locc'):
+        qc_LOCC = qc_LOCC.defer_measurements()[0]
+    qc = TCcircuit(qc_LOCC.num_qubits, qreg='qLOCC')
+    qc.compose(cached_block('TCstate', m, ancilla, topology, anc_opt, IR=True), qubits=[*range(1, qc.num_qubits)], inplace=True)
+    qc.compose(qc_LOCC, qubits=[*range(qc.num_qubits)], inplace=True)
+    return qc
+def mps_clone_operators(variant, max_bond=None, cutoff=1e-12):
+    qc = _mps_circuit(variant)
+    tensors, error, bond = mps_evolve(qc, mps_product_state(qc.num_qubits, open_message=True), max_bond, cutoff)
+    metadata = variant_metadata(variant)
+    for q, value in (metadata['post_select_indices'] or {}).items():
+        tensors[q] = tensors[q].copy()
+        tensors[q][:, 1-value] = 0
+    # right environments, then the left environment with the open message indices (a, b) swept over the clones
+    right = [numpy.ones((1, 1))]
+    for t in tensors[:0:-1]:
+        right.append(numpy.einsum('asb,csd,bd->ac', t, t.conj(), right[-1]))
+    right = right[::-1]
+    left = numpy.einsum('ax,by->abxy', numpy.eye(2), numpy.eye(2)).astype(complex)
+    R = {}
+    for q, t in enumerate(tensors):
+        if (q in metadata['clone_indices']):
+            R[q] = numpy.einsum('abxy,xsz,ytw,zw->abst', left, t, t.conj(), right[q])
+        left = numpy.einsum('abxy,xsz,ysw->abzw', left, t, t.conj())
+    return numpy.stack([R[q] for q in metadata['clone_indices']]), error, bond
+def mps_clone_states(variant, ryangles, rzangles, max_bond=None, cutoff=1e-12):
+    R, error, _ = mps_clone_operators(variant, max_bond, cutoff)
+    psi = message_statevectors(ryangles, rzangles).reshape(-1, 2)
+    rhos = numpy.einsum('na,nb,kabij->nkij', psi, psi.conj(), R)
+    probabilities = numpy.real(numpy.trace(rhos[:, 0], axis1=1, axis2=2))
+    rhos /= probabilities[:, None, None, None]
+    fidelities = numpy.real(numpy.einsum('ni,nkij,nj->nk', psi.conj(), rhos, psi))
+    return rhos, fidelities, probabilities, error
+
+
+''' Multi-copy packing: independent copies of a variant on disjoint device subgraphs, in one circuit
+    pack_layouts
+    - up to copies (default: as many as fit) disjoint SWAP-free layouts of a variant on the coupling map, found greedily
+      with heavy_hex_layout, so only for the T-shaped 'LNN' / 'heavyhex' circuits
+    - separation=1 also keeps different copies on non-adjacent qubits (less crosstalk), at the cost of fewer copies
+    - returns the list of layouts (lists of physical qubits), the initial layout of the packed circuit is their concatenation
+    construct_packed_circuit
+    - one copy of the variant per message state (ryangles, rzangles broadcast, row-major), copy k on the qubits and
+      classical bits k*width .. (k+1)*width-1 of a single circuit
+    - returns (qc, clone_indices, rhos, post_select_indices), the latter three lists over the copies with indices into the
+      packed circuit (post_select_indices None if the variant does not postselect)
+    demultiplex_counts
+    - splits the counts of a packed circuit into the counts of its copies, with the bitstrings of copy k reduced to its
+      own width bits, i.e. as if the copy had run alone (use the indices of construct_variant_circuit / variant_metadata)
+'''
+def pack_layouts(variant, coupling_map, copies=None, exclude=(), separation=0):
+    m, ancilla, topology, locc = get_variant(variant)[0:4]
+    neighbors = _coupling_neighbors(coupling_map)
+    exclude, layouts = set(exclude), []
+    while (copies is None or len(layouts) < copies):
+        layout = heavy_hex_layout(m, coupling_map, ancilla, topology, locc, exclude)
+        if layout is None:
+            break
+        layouts.append(layout)
+        blocked = set(layout)
+        for _ in range(separation):
+            blocked |= {q for b in blocked for q in neighbors.get(b, ())}
+        exclude |= blocked
+    return layouts
+def construct_packed_circuit(variant, ryangles, rzangles, IR=False):
+    template = _variant_template(variant, True)
+    assert len(template) == 3 or isinstance(template[3], dict), "packing needs Qiskit circuits, not HQS_QASM if-statements"
+    copies = construct_variant(variant, ryangles, rzangles, IR=True)
+    width = template[0].num_qubits
+    qc = TCcircuit(width*len(copies), width*len(copies))
+    clone_indices, rhos, post_select_indices = [], [], []
+    for k, (qc_copy, clones, rho, *post_select) in enumerate(copies):
+        qc.compose(qc_copy, qubits=[*range(k*width, (k+1)*width)], clbits=[*range(k*width, (k+1)*width)], inplace=True)
+        clone_indices.append([k*width + c for c in clones])
+        rhos.append(rho)
+        post_select_indices.append({k*width + q: v for q, v in post_select[0].items()} if post_select else None)
+    return qc if IR else qc.to_qiskit(), clone_indices, rhos, post_select_indices
+def demultiplex_counts(counts, copies, width):
+    demultiplexed = [{} for _ in range(copies)]
+    for bitstring, count in counts.items():
+        bits = bitstring.replace(' ', '')[::-1]
+        for k in range(copies):
+            key = bits[k*width:(k+1)*width][::-1]
+            demultiplexed[k][key] = demultiplexed[k].get(key, 0) + count
+    return demultiplexed
+
+
+''' Cost model
+    circuit_cost
+    - CX count, single qubit gate count, depth and width of construct_circuit(.., m, ancilla, topology, locc, .., anc_opt)
+    - gate counts are closed-form sums over the building blocks, depth is the closed-form depth of the TCstate plus that
+      of LOCC (the barrier between them aligns all qubits), no circuit is built; the block depths are exact for the ASAP
+      schedule of the gate lists (checked by verify_circuits up to m=50), with the DSUs overlapping the inputHW ladder
+    - single qubit gates include the message rotations and the (classically controlled) X/Z corrections, no measurements
+    - 'measure' counts mid-circuit measurements ('locc' only), measurements for tomography are not included
+    - ancilla-free TCstates for m>3 come from the lookup table (see TCstate_from_table) and are counted off its gate list
+    transpiled_circuit_cost
+    - the same numbers after transpiling onto a coupling map (optional estimate, builds and transpiles the circuit)
+    variant_cost
+    - circuit_cost of a registry variant, see VARIANTS
+'''
+def _SCS_cost(m):
+    return {'cx': 5*m-8, 'single_qubit': 4*m-4}
+def _DSU_cost(m):
+    l_sum = m*(m+1)//2 - 1
+    return {'cx': 5*l_sum - 8*(m-1), 'single_qubit': 4*l_sum - 4*(m-1)}
+def _inputHW_cost(m, ancilla, topology):
+    if (ancilla):
+        if (topology in LNN_TOPOLOGIES):
+            return {'cx': 1 + m*(m-1) + 3*(m-1) + (m-1)*(m-2), 'single_qubit': 1 + 2*(m-1)}
+        return {'cx': 2*m-1, 'single_qubit': 1 + 2*(m-1)}
+    if (m == 2):
+        return {'cx': 1, 'single_qubit': 1}
+    if (topology in LNN_TOPOLOGIES):
+        return {'cx': 3, 'single_qubit': 7}
+    return {'cx': 2, 'single_qubit': 8}
+def _LOCC_cost(m, topology, locc, log_depth=False):
+    if (locc == 'locc'):
+        return {'cx': 1, 'single_qubit': 1 + 2*m, 'measure': 2}
+    if (locc == 'dfm'):
+        if (topology in LNN_TOPOLOGIES):
+            return {'cx': 4*m, 'single_qubit': 0, 'measure': 0}
+        return {'cx': 4*m-1 if (log_depth and m >= LOG_DEPTH_MIN_M) else 2*m+1, 'single_qubit': 0, 'measure': 0}
+    return {'cx': 1, 'single_qubit': 1 + m*(locc[2] == '1') + m*(locc[3] == '1'), 'measure': 0}
+def _TCstate_depth(m, ancilla, topology, anc_opt):
+    if (not ancilla):
+        if (m == 2):
+            return 6
+        if (m == 3):
+            return 24 if (topology in LNN_TOPOLOGIES) else 23
+        return cached_block('TCstate', m, ancilla, topology, IR=True).depth()
+    if (topology in LNN_TOPOLOGIES):
+        if (anc_opt):
+            return {2: 11, 3: 27}.get(m, 26*m-54)
+        return {2: 11, 3: 28, 4: 52}.get(m, 26*m-51)
+    return {2: 9, 3: 24}.get(m, 25*m-55)
+def _LOCC_depth(m, topology, locc, log_depth=False):
+    if (locc == 'locc'):
+        return m+3
+    if (locc == 'dfm'):
+        if (topology in LNN_TOPOLOGIES):
+            return 7 if (m == 2) else m+6
+        return 4*(m-1).bit_length()+2 if (log_depth and m >= LOG_DEPTH_MIN_M) else m+2
+    return 2
+def circuit_cost(m, ancilla=True, topology='LNN', locc='dfm', anc_opt=False, log_depth=False):
+    if (not ancilla and m > 3):
+        # lookup table TCstate, counted off its gate list
+        counts = cached_block('TCstate', m, ancilla, topology, IR=True).count_ops()
+        blocks = [{'cx': counts.get('cx', 0), 'single_qubit': sum(counts.values()) - counts.get('cx', 0)}, {'cx': 0, 'single_qubit': 0}, _LOCC_cost(m, topology, locc, log_depth)]
+    else:
+        blocks = [_inputHW_cost(m, ancilla, topology), _DSU_cost(m), _LOCC_cost(m, topology, locc, log_depth)]
+    if (ancilla):
+        blocks.append(_SCS_cost(m) if anc_opt else _DSU_cost(m))
+    return {'width': 2*m+1 if ancilla else m+2,
+            'cx': sum(block['cx'] for block in blocks),
+            'single_qubit': 2 + sum(block['single_qubit'] for block in blocks),
+            'measure': blocks[2]['measure'],
+            'depth': _TCstate_depth(m, ancilla, topology, anc_opt) + _LOCC_depth(m, topology, locc, log_depth)}
+def transpiled_circuit_cost(m, ancilla, topology, locc, coupling_map, anc_opt=False, optimization_level=3, initial_layout=None, basis_gates=["x", "sx", "cx", "rz"], seed_transpiler=None, log_depth=False):
+    # generic message angles, so that the message rotations are not optimized away
+    qc = construct_circuit(1.1, 0.7, m, ancilla, topology, locc, True, anc_opt, log_depth=log_depth)[0]
+    transpiled = transpile(qc, coupling_map=coupling_map, optimization_level=optimization_level, basis_gates=basis_gates, initial_layout=initial_layout, seed_transpiler=seed_transpiler)
+    counts = transpiled.count_ops()
+    return {'width': len(set(transpiled.find_bit(q).index for instruction in transpiled.data for q in instruction.qubits)),
+            'cx': counts.get('cx', 0),
+            'single_qubit': sum(counts.get(gate, 0) for gate in basis_gates if gate != 'cx'),
+            'measure': counts.get('measure', 0),
+            'depth': transpiled.depth()}
+def variant_cost(variant):
+    m, ancilla, topology, locc, _, anc_opt, log_depth = get_variant(variant)
+    return circuit_cost(m, ancilla, topology, locc, anc_opt, log_depth)
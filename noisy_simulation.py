@@ -0,0 +1,179 @@
+"""
+© 2022. Triad National Security, LLC. All rights reserved.
+This program was produced under U.S. Government contract 89233218CNA000001 for Los Alamos
+National Laboratory (LANL), which is operated by Triad National Security, LLC for the U.S.
+Department of Energy/National Nuclear Security Administration. All rights in the program are
+reserved by Triad National Security, LLC, and the U.S. Department of Energy/National Nuclear
+Security Administration. The Government is granted for itself and others acting on its behalf a
+nonexclusive, paid-up, irrevocable worldwide license in this material to reproduce, prepare
+derivative works, distribute copies to the public, perform publicly and display publicly, and to permit
+others to do so.
+"""
+
+from create_telecloning_circuits import *
+from qiskit.circuit import ParameterExpression
+from qiskit.transpiler import CouplingMap
+from qiskit.providers.models import BackendProperties
+from qiskit_aer.noise.device import basic_device_gate_errors, basic_device_readout_errors
+import sympy
+import argparse
+
+''' Noisy simulation from device calibration snapshots, exact (density matrices) instead of shots
+    save_calibration(properties, path) / load_calibration(path)
+    - stores / reads the BackendProperties (gate errors and lengths, T1/T2, readout errors) of a device as json,
+      e.g. save_calibration(backend.properties(), 'calibration_ibmq_montreal.json') when the jobs are submitted
+    calibration_noise(properties)
+    - the errors of all calibrated gates {(gate, qubits): QuantumError} (depolarizing and thermal relaxation, as in the
+      Aer NoiseModel.from_backend_properties used for shot-based runs) and the readout probability matrices
+      {qubit: [[p(0|0), p(1|0)], [p(0|1), p(1|1)]]}
+    calibration_coupling_map(properties)
+    - coupling map of the calibrated 'cx' gates
+    transpile_variant(variant, coupling_map, initial_layout, optimization_level=3)
+    - the circuit of a variant transpiled once to the basis gates of the IBMQ experiments, in two parts: the message
+      preparation (on one qubit, with the message angles as Parameters) and the angle-independent rest
+    - returns (preparation, rest, physical positions of the (virtual) qubits before and after the rest)
+    noisy_clone_states(variant, properties, ryangles, rzangles, initial_layout, ...)
+    - noisy clone density matrices for all message angles at once: the noisy channel of the rest is evolved once on the
+      4 operators |a⟩⟨b| of the message qubit (density matrices of the active qubits), the preparation is applied per
+      angle on the message qubit only, with its gate noise (transpiled separately, so its single qubit gates are not
+      merged with the first gates of the rest as in the transpiled experiment circuits)
+    - readout=True: as reconstructed by linear inversion tomography from noisy readout of the clones (readout errors
+      contract and shift every Bloch vector component), with the readout errors also in the postselection
+    - the noise of the tomography basis rotations and idle qubits is not modelled (as in the NoiseModel without scheduling)
+    - returns (rhos (N, m, 2, 2), fidelities (N, m), probabilities (N,)), in the clone order of the variant
+    usage: python noisy_simulation.py calibration_ibmq_montreal.json deferred_measurement_PCC --layout 16 19 22 25
+'''
+def save_calibration(properties, path):
+    with open(path, 'w') as file:
+        json.dump(properties.to_dict(), file, default=str)
+def load_calibration(path):
+    with open(path) as file:
+        return BackendProperties.from_dict(json.load(file))
+
+def calibration_noise(properties):
+    errors = {(name, tuple(qubits)): error for name, qubits, error in basic_device_gate_errors(properties)}
+    readout = {qubits[0]: numpy.array(error.probabilities) for qubits, error in basic_device_readout_errors(properties)}
+    return errors, readout
+def calibration_coupling_map(properties):
+    return CouplingMap([gate.qubits for gate in properties.gates if gate.gate == 'cx'])
+
+def transpile_variant(variant, coupling_map, initial_layout, optimization_level=3):
+    m, ancilla, topology, locc, Qiskit_version_if_statements, anc_opt, log_depth = get_variant(variant)
+    qc, _, (ryangle, rzangle), *_ = cached_circuit_template(m, ancilla, topology, locc, Qiskit_version_if_statements, anc_opt, False, log_depth)
+    transpiled = transpile(qc.assign_parameters({ryangle: 0, rzangle: 0}), coupling_map=coupling_map, optimization_level=optimization_level,
+                           basis_gates=["x", "sx", "cx", "rz"], initial_layout=list(initial_layout)[0:qc.num_qubits], seed_transpiler=0)
+    preparation = QuantumCircuit(1)
+    preparation.ry(ryangle, 0)
+    preparation.rz(rzangle, 0)
+    preparation = transpile(preparation, basis_gates=["x", "sx", "cx", "rz"], optimization_level=1)
+    return preparation, transpiled, transpiled.layout.initial_index_layout()[0:qc.num_qubits], transpiled.layout.final_index_layout()
+
+# SuperOp matrices of the gate errors, converted when first used
+class _SuperOps(dict):
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = errors
+    def __missing__(self, key):
+        self[key] = qi.SuperOp(self.errors[key].to_quantumchannel()).data
+        return self[key]
+    def __contains__(self, key):
+        return key in self.errors
+
+def _noisy_channel(transpiled, channels, message):
+    qubit_index = {bit: transpiled.find_bit(bit).index for bit in transpiled.qubits}
+    rest = [(instruction.operation, [qubit_index[q] for q in instruction.qubits]) for instruction in transpiled.data
+            if instruction.operation.name not in ['barrier', 'measure']]
+    active = sorted({message} | {q for _, qubits in rest for q in qubits})
+    local = {q: i for i, q in enumerate(active)}
+    outputs = []
+    for a, b in itertools.product(range(2), range(2)):
+        rho = numpy.zeros((2**len(active),)*2, dtype=complex)
+        rho[1 << local[message] if a else 0, 1 << local[message] if b else 0] = 1
+        rho = qi.DensityMatrix(rho)
+        for operation, qubits in rest:
+            qargs = [local[q] for q in qubits]
+            rho = rho.evolve(qi.Operator(operation), qargs)
+            if (operation.name, tuple(qubits)) in channels:
+                rho = rho.evolve(qi.SuperOp(channels[(operation.name, tuple(qubits))]), qargs)
+        outputs.append(rho.data)
+    return numpy.array(outputs).reshape(2, 2, *rho.data.shape), active
+
+# batched noisy preparation of the message qubit, from |0⟩⟨0|: the gates are rz (with the message angles) and sx, x
+def _noisy_preparation(preparation, channels, message, ryangles, rzangles):
+    ryangles, rzangles = numpy.broadcast_arrays(numpy.asarray(ryangles, dtype=float), numpy.asarray(rzangles, dtype=float))
+    ryangles, rzangles = ryangles.ravel(), rzangles.ravel()
+    symbols = sympy.symbols('ryangle rzangle')
+    rho = numpy.zeros((ryangles.size, 2, 2), dtype=complex)
+    rho[:, 0, 0] = 1
+    for operation in (instruction.operation for instruction in preparation.data):
+        if (operation.name == 'rz'):
+            angle = operation.params[0]
+            if isinstance(angle, ParameterExpression):
+                angle = sympy.lambdify(symbols, sympy.sympify(str(angle.sympify())), 'numpy')(ryangles, rzangles)
+            angle = numpy.broadcast_to(numpy.asarray(angle, dtype=float), ryangles.shape)
+            U = numpy.zeros((ryangles.size, 2, 2), dtype=complex)
+            U[:, 0, 0], U[:, 1, 1] = numpy.exp(-0.5j*angle), numpy.exp(0.5j*angle)
+        else:
+            U = numpy.broadcast_to(qi.Operator(operation).data, (ryangles.size, 2, 2))
+        rho = U @ rho @ U.conj().transpose(0, 2, 1)
+        if (operation.name, (message,)) in channels:
+            # SuperOp acts on column-stacked density matrices
+            S = channels[(operation.name, (message,))]
+            rho = (rho.transpose(0, 2, 1).reshape(-1, 4) @ S.T).reshape(-1, 2, 2).transpose(0, 2, 1)
+    return rho, message_statevectors(ryangles, rzangles).reshape(-1, 2)
+
+def _reduced_operator(rho, n, keep, weights):
+    # rho: density operator of n qubits (little endian); trace all qubits but keep, with diagonal weights on some of them
+    operands = [rho.reshape((2,)*2*n), [*range(n-1, -1, -1)] + [n+q if q == keep else q for q in range(n-1, -1, -1)]]
+    for q, w in weights.items():
+        operands += [w, [q]]
+    return numpy.einsum(*operands, [keep, n+keep])
+
+def noisy_clone_states(variant, properties, ryangles, rzangles, initial_layout, coupling_map=None, optimization_level=3, readout=True):
+    errors, readout_probabilities = calibration_noise(properties)
+    channels = _SuperOps(errors)
+    coupling_map = calibration_coupling_map(properties) if coupling_map is None else coupling_map
+    preparation, transpiled, initial_positions, positions = transpile_variant(variant, coupling_map, initial_layout, optimization_level)
+    metadata = variant_metadata(variant)
+    message = initial_positions[0]
+    outputs, active = _noisy_channel(transpiled, channels, message)
+    local = {q: i for i, q in enumerate(active)}
+    # postselection: projection, or the POVM element of the observed value under readout errors
+    weights = {}
+    for q, value in (metadata['post_select_indices'] or {}).items():
+        weights[local[positions[q]]] = readout_probabilities[positions[q]][:, value] if readout else numpy.eye(2)[value]
+    clones = [positions[q] for q in metadata['clone_indices']]
+    R = numpy.array([[[_reduced_operator(outputs[a, b], len(active), local[clone], weights) for clone in clones]
+                      for b in range(2)] for a in range(2)])
+    rho_message, psi = _noisy_preparation(preparation, channels, message, ryangles, rzangles)
+    rhos = numpy.einsum('nab,abkij->nkij', rho_message, R)
+    probabilities = numpy.real(numpy.trace(rhos[:, 0], axis1=1, axis2=2))
+    rhos /= probabilities[:, None, None, None]
+    if readout:
+        for k, clone in enumerate(clones):
+            (p00, p01), (p10, p11) = readout_probabilities[clone]
+            shift = 0.5*(p10 - p01)*numpy.array([[1, 1-1j], [1+1j, -1]])
+            rhos[:, k] = (1-p01-p10)*rhos[:, k] + 0.5*(p01+p10)*numpy.eye(2) + shift
+    fidelities = numpy.real(numpy.einsum('ni,nkij,nj->nk', psi.conj(), rhos, psi))
+    return rhos, fidelities, probabilities
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='exact noisy clone states from a device calibration snapshot')
+    parser.add_argument('calibration', help='calibration snapshot (json), see save_calibration')
+    parser.add_argument('variant', help='variant name, e.g. deferred_measurement_PCC or PCC_postselect_00')
+    parser.add_argument('--layout', type=int, nargs='+', required=True, help='physical qubits of the variant qubits')
+    parser.add_argument('--angles', type=int, default=17, help='message angle slices (ry in [0,pi], rz in [0,2pi])')
+    parser.add_argument('--no-readout', action='store_true', help='clone states without readout errors')
+    parser.add_argument('--output', default=None, help='npz file for the angles, clone states, fidelities and probabilities')
+    args = parser.parse_args()
+    ryangles = numpy.linspace(0, math.pi, num=args.angles)[:, None]
+    rzangles = numpy.linspace(0, 2*math.pi, num=args.angles)[None, :]
+    t0 = time.time()
+    rhos, fidelities, probabilities = noisy_clone_states(args.variant, load_calibration(args.calibration), ryangles, rzangles, args.layout, readout=not args.no_readout)
+    for k in range(fidelities.shape[1]):
+        print("clone {}: fidelity mean {:.4f} min {:.4f} max {:.4f}".format(k+1, fidelities[:, k].mean(), fidelities[:, k].min(), fidelities[:, k].max()))
+    print("{} message states in {:.2f}s".format(fidelities.shape[0], time.time()-t0))
+    if args.output is not None:
+        ryangles, rzangles = numpy.broadcast_arrays(ryangles, rzangles)
+        numpy.savez(args.output, ryangles=ryangles.ravel(), rzangles=rzangles.ravel(), rhos=rhos, fidelities=fidelities, probabilities=probabilities)
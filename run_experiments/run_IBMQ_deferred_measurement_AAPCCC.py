@@ -14,6 +14,7 @@ import sys
 sys.path.append("../")
 from utils import *
 from create_telecloning_circuits import *
+from noisy_simulation import save_calibration
 from qiskit import *
 import copy
 from qiskit.transpiler import CouplingMap
@@ -21,6 +22,9 @@ import numpy as np
 
 OPT_LEVEL = 3
 
+# packing mode: copies of the circuit on all disjoint subgraphs found by pack_layouts, each copy with its own message state
+PACKED = False
+
 device_name = "ibmq_montreal"
 
 subg = [6, 1, 4, 7, 10, 12, 15]
@@ -34,6 +38,10 @@ IBMQ.load_account()
 provider = IBMQ.get_provider(hub='', group='', project='')
 backend = provider.get_backend(device_name)
 coupling_map = CouplingMap(backend.configuration().coupling_map)
+if PACKED:
+	layouts = pack_layouts("deferred_measurement_AAPCCC", coupling_map)
+	subg = sum(layouts, [])
+	packed_metadata = variant_metadata("deferred_measurement_AAPCCC")
 
 N_shots = 30000
 N_Angle_slices = 17
@@ -52,19 +60,39 @@ def get_transpiled_circuits(angle_ry, angle_rz):
 	transpiled = transpile(copy.deepcopy(tomography_circuits), coupling_map=coupling_map, optimization_level=OPT_LEVEL, basis_gates=["x", "sx", "cx", "rz"], initial_layout=subg)
 	return transpiled
 
+# circuit names are those of the first copy, the counts of each copy are recovered with demultiplex_counts(counts, copies, width),
+# from the packing metadata saved next to the job id (layouts, width, clone indices and the message angles of every copy)
+def get_packed_transpiled_circuits(angles_ry, angles_rz):
+	qc_tc, clone_indices, _, _ = construct_packed_circuit("deferred_measurement_AAPCCC", angles_ry, angles_rz)
+	tomography_circuits = parallel_qubit_state_tomography_general(sum(clone_indices, []), qc_tc, angles_ry[0], angles_rz[0])
+	transpiled = transpile(copy.deepcopy(tomography_circuits), coupling_map=coupling_map, optimization_level=OPT_LEVEL, basis_gates=["x", "sx", "cx", "rz"], initial_layout=subg[0:qc_tc.num_qubits])
+	return transpiled
+
 angles_ry = np.linspace(0, math.pi, num=N_Angle_slices)
 angles_rz = np.linspace(0, 2*math.pi, num=N_Angle_slices)
 
 compiled_circuits = []
 
-for angle_ry in angles_ry:
-	for angle_rz in angles_rz:
-		circuits = get_transpiled_circuits(float(angle_ry), float(angle_rz))
-		compiled_circuits += circuits
+if PACKED:
+	angle_pairs = [(float(angle_ry), float(angle_rz)) for angle_ry in angles_ry for angle_rz in angles_rz]
+	chunks = [angle_pairs[i:i+len(layouts)] for i in range(0, len(angle_pairs), len(layouts))]
+	for chunk in chunks:
+		compiled_circuits += get_packed_transpiled_circuits([angle_ry for angle_ry, _ in chunk], [angle_rz for _, angle_rz in chunk])
+else:
+	for angle_ry in angles_ry:
+		for angle_rz in angles_rz:
+			circuits = get_transpiled_circuits(float(angle_ry), float(angle_rz))
+			compiled_circuits += circuits
 
 print("total circuits before error mitigation =", len(compiled_circuits))
-qubits_to_measure = extract_qubit_indices_which_are_measured(compiled_circuits)
-measurement_err_mitigation_circuits = generate_transpiled_measurement_error_mitigation_circuits(qubits_to_measure, coupling_map)
+if PACKED:
+	# one calibration block per copy (tensored), not the 2^(copies*clones) states of all measured qubits;
+	# the layouts are SWAP-free, so the clones of copy k stay on layouts[k]
+	qubits_to_measure = [layout[c] for layout in layouts for c in packed_metadata['clone_indices']]
+	measurement_err_mitigation_circuits, mit_pattern = generate_transpiled_tensored_measurement_error_mitigation_circuits(qubits_to_measure, len(layouts), coupling_map)
+else:
+	qubits_to_measure = extract_qubit_indices_which_are_measured(compiled_circuits)
+	measurement_err_mitigation_circuits = generate_transpiled_measurement_error_mitigation_circuits(qubits_to_measure, coupling_map)
 compiled_circuits = measurement_err_mitigation_circuits+compiled_circuits
 print("total circuits=", len(compiled_circuits))
 
@@ -76,3 +104,12 @@ job_filename = "AAPCCC_"+device_name+subgraph_name+"_"+str(N_shots)+"_"+str(N_An
 file = open("job_ids_deferred_measurement/"+job_filename, "w")
 file.write(str(id))
 file.close()
+if PACKED:
+	# packed circuit j (circuits 3j..3j+2 after the calibration circuits) holds copy k with the message angles chunks[j][k]
+	packing = {'variant': "deferred_measurement_AAPCCC", 'layouts': layouts, 'width': packed_metadata['width'], 'clone_indices': packed_metadata['clone_indices'],
+		'measured_qubits': qubits_to_measure, 'mit_pattern': mit_pattern, 'calibration_circuits': len(measurement_err_mitigation_circuits), 'chunks': chunks}
+	with open("job_ids_deferred_measurement/"+job_filename[:-len(".txt")]+"_packing.json", "w") as file:
+		json.dump(packing, file)
+
+# calibration snapshot of the device at submission, for the noisy simulation (noisy_simulation.py)
+save_calibration(backend.properties(), "job_ids_deferred_measurement/"+device_name+subgraph_name+"calibration.json")
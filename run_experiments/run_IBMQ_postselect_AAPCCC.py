@@ -14,6 +14,7 @@ import sys
 sys.path.append("../")
 from utils import *
 from create_telecloning_circuits import *
+from noisy_simulation import save_calibration
 from qiskit import *
 import copy
 from qiskit.transpiler import CouplingMap
@@ -127,3 +128,6 @@ job_filename = "AAPCCC_"+device_name+subgraph_name+"_"+str(N_shots)+"_"+str(N_An
 file = open("job_ids_postselect/"+job_filename, "w")
 file.write(str(id))
 file.close()
+
+# calibration snapshot of the device at submission, for the noisy simulation (noisy_simulation.py)
+save_calibration(backend.properties(), "job_ids_postselect/"+device_name+subgraph_name+"calibration.json")
@@ -24,28 +24,12 @@ status = qapi.status()
 print(machine, ":", status)
 
 def run(angle_ry, angle_rz):
-	qc, clone_indices, rho, HQS_QASM = construct_PCC_Honeywell_QASM_circuit_Qiskit_version(angle_ry, angle_rz, False)
-	QASM = qc.qasm()+HQS_QASM
-	QASM = QASM.replace('qelib1.inc', 'hqslib1.inc')
-	tomography_circuit_Y, tomography_circuit_X, tomography_circuit_Z = append_parallel_qubit_tomography_to_Honeywell_QASM(clone_indices, QASM)
-	
-	job_id = qapi.submit_job(tomography_circuit_Y, shots=300, machine='H1-2')
-	print(job_id)
-	file = open("Quantinuum_H1_2_results/PCC_job_"+str(angle_ry)+"_"+str(angle_rz)+"_Y.txt", "w")
-	file.write(job_id)
-	file.close()
-	
-	job_id = qapi.submit_job(tomography_circuit_X, shots=300, machine='H1-2')
-	print(job_id)
-	file = open("Quantinuum_H1_2_results/PCC_job_"+str(angle_ry)+"_"+str(angle_rz)+"_X.txt", "w")
-	file.write(job_id)
-	file.close()
-	
-	job_id = qapi.submit_job(tomography_circuit_Z, shots=300, machine='H1-2')
-	print(job_id)
-	file = open("Quantinuum_H1_2_results/PCC_job_"+str(angle_ry)+"_"+str(angle_rz)+"_Z.txt", "w")
-	file.write(job_id)
-	file.close()
+	for angle_ry, angle_rz, basis, tomography_circuit in HQS_QASM_programs("PCC_Honeywell_QASM_circuit_Qiskit_version", [angle_ry], angle_rz):
+		job_id = qapi.submit_job(tomography_circuit, shots=300, machine='H1-2')
+		print(job_id)
+		file = open("Quantinuum_H1_2_results/PCC_job_"+str(angle_ry)+"_"+str(angle_rz)+"_"+basis+".txt", "w")
+		file.write(job_id)
+		file.close()
 
 N_Angle_slices = 6
 
@@ -0,0 +1,159 @@
+"""
+© 2022. Triad National Security, LLC. All rights reserved.
+This program was produced under U.S. Government contract 89233218CNA000001 for Los Alamos
+National Laboratory (LANL), which is operated by Triad National Security, LLC for the U.S.
+Department of Energy/National Nuclear Security Administration. All rights in the program are
+reserved by Triad National Security, LLC, and the U.S. Department of Energy/National Nuclear
+Security Administration. The Government is granted for itself and others acting on its behalf a
+nonexclusive, paid-up, irrevocable worldwide license in this material to reproduce, prepare
+derivative works, distribute copies to the public, perform publicly and display publicly, and to permit
+others to do so.
+"""
+
+from noisy_simulation import *
+from qiskit import Aer
+from qiskit_aer.noise import NoiseModel
+import argparse
+
+''' Simulation method dispatcher for message angle sweeps
+    The requested outputs decide which engines apply:
+    - clone states (shots=None): 'symmetric' (symmetric_clone_states, O(m^2)), 'exact' (exact_clone_states, statevector
+      of the LOCC part), 'mps' (mps_clone_states), or 'noisy' (noisy_clone_states, density matrices) with a calibration
+    - tomography counts (shots given): 'emulate' (emulate_tomography_counts, one vectorized sampling call),
+      'shared_prefix' (shared_prefix_tomography_sweep, one statevector per message state, memory independent of the grid),
+      or Aer in one job (run_tomography_sweep) with the 'statevector', 'density_matrix' or 'matrix_product_state' method,
+      the only engines for counts with a device noise model (transpiled onto the calibrated coupling map)
+    simulation_costs(variant, N, shots=None, properties=None, max_bond=None, memory=MEMORY_BUDGET)
+    - predicted run time in seconds of every applicable engine for N message states, from the gate counts of
+      variant_cost, the width and the numbers of measured qubits; engines whose arrays exceed memory (bytes) are left out
+    - rough operation counts times the constants below (numpy and Aer on one core), meant to rank the engines
+    choose_simulation_method(variant, N, shots=None, properties=None, max_bond=None, memory=MEMORY_BUDGET)
+    - the cheapest applicable engine, returns (method, costs)
+    simulate_sweep(variant, ryangles, rzangles, shots=None, properties=None, initial_layout=None, method='auto', ...)
+    - runs the sweep with the chosen (or given) engine and logs the decision and the predicted costs (log=None: silent)
+    - returns (results, method): (rhos (N, m, 2, 2), fidelities (N, m), probabilities (N,)) for clone states (all clones
+      equal for 'symmetric'), the list of {basis: counts} per message state for counts, in row-major order of the angles
+    - max_bond truncates 'mps' and the Aer MPS; initial_layout places the variant on the calibrated device (default:
+      qubits 0..width-1); backend (default Aer qasm_simulator) and seed apply to the shot based engines
+    usage: python simulate_sweep.py deferred_measurement_PCC --angles 100 --shots 30000
+'''
+MEMORY_BUDGET = 2**31
+FLOP_TIME = 2e-9 # complex multiply-add in numpy
+GATE_TIME = 2e-5 # python and call overhead per gate
+SVD_TIME = 2e-4 # per two-qubit gate of the MPS simulation
+COUNT_TIME = 1e-6 # per entry of a counts dictionary
+AER_EXPERIMENT_TIME = 0.02 # per experiment (circuit and parameter bind) of an Aer job
+AER_FLOP_TIME = 1e-9
+TRANSPILE_TIME = 1.0 # transpilation onto the calibrated device
+STATE_METHODS = ('symmetric', 'exact', 'mps', 'noisy')
+COUNT_METHODS = ('emulate', 'shared_prefix', 'aer_statevector', 'aer_density_matrix', 'aer_matrix_product_state')
+
+def simulation_costs(variant, N, shots=None, properties=None, max_bond=None, memory=MEMORY_BUDGET):
+    variant = get_variant(variant)
+    m, ancilla, topology, locc = variant[0:4]
+    cost = variant_cost(variant)
+    w, gates = cost['width'], cost['cx'] + cost['single_qubit']
+    metadata = variant_metadata(variant)
+    k = len(metadata['clone_indices']) + len(metadata['post_select_indices'] or {}) + 2*(locc == 'locc')
+    # bond dimension of the telecloning state MPS (Dicke weights on ancillas and clones), routing SWAPs without 'LNN'
+    chi = min(2*(m+1) if max_bond is None else max_bond, 2**(w//2))
+    routing = 1 if (topology in LNN_TOPOLOGIES) else w
+    costs = {}
+    if (shots is None):
+        if (properties is not None):
+            if (4*16*4**w <= memory):
+                costs['noisy'] = TRANSPILE_TIME + 4*3*gates*(GATE_TIME + FLOP_TIME*4**w) + N*m*16*FLOP_TIME
+            return costs
+        if (ancilla or m <= 3 or TCstate_from_table(m, topology) is not None):
+            costs['symmetric'] = m*GATE_TIME + (m**2 + N*16)*FLOP_TIME
+        if (4*16*2**w <= memory):
+            costs['exact'] = gates*(GATE_TIME + FLOP_TIME*2**(w+1)) + N*m*16*FLOP_TIME
+        costs['mps'] = gates*routing*(SVD_TIME + FLOP_TIME*8*chi**3) + N*m*16*FLOP_TIME
+        return costs
+    entries = N*3*min(2**k, shots)
+    if (properties is None):
+        if (4*16*2**w + 2*N*3*8*2**k <= memory):
+            costs['emulate'] = gates*(GATE_TIME + FLOP_TIME*2**(w+1)) + 3*w*FLOP_TIME*2**(w+1) + N*3*4*FLOP_TIME*2**k + entries*COUNT_TIME
+        if (4*16*2**w <= memory):
+            costs['shared_prefix'] = N*(gates*(GATE_TIME + FLOP_TIME*2**w) + 3*(GATE_TIME + w*FLOP_TIME*2**w)) + entries*COUNT_TIME
+            # one final state per experiment, all shots sampled from it
+            costs['aer_statevector'] = 3*N*(AER_EXPERIMENT_TIME + gates*AER_FLOP_TIME*2**w + shots*k*AER_FLOP_TIME)
+        costs['aer_matrix_product_state'] = 3*N*(AER_EXPERIMENT_TIME + gates*routing*AER_FLOP_TIME*8*chi**3 + shots*w*AER_FLOP_TIME*4*chi**3)
+        return costs
+    # with noise: statevector trajectories per shot, one density matrix, or MPS trajectories
+    if (4*16*2**w <= memory):
+        costs['aer_statevector'] = TRANSPILE_TIME + 3*N*(AER_EXPERIMENT_TIME + shots*gates*AER_FLOP_TIME*2**w)
+    if (4*16*4**w <= memory):
+        costs['aer_density_matrix'] = TRANSPILE_TIME + 3*N*(AER_EXPERIMENT_TIME + 3*gates*AER_FLOP_TIME*4**w)
+    costs['aer_matrix_product_state'] = TRANSPILE_TIME + 3*N*(AER_EXPERIMENT_TIME + shots*gates*routing*AER_FLOP_TIME*8*chi**3)
+    return costs
+
+def choose_simulation_method(variant, N, shots=None, properties=None, max_bond=None, memory=MEMORY_BUDGET):
+    costs = simulation_costs(variant, N, shots, properties, max_bond, memory)
+    if not costs:
+        raise ValueError("no simulation method fits the memory budget of {} bytes".format(memory))
+    return min(costs, key=costs.get), costs
+
+def simulate_sweep(variant, ryangles, rzangles, shots=None, properties=None, initial_layout=None, method='auto', seed=None, max_bond=None, backend=None, memory=MEMORY_BUDGET, log=print):
+    variant = get_variant(variant)
+    m, ancilla, topology, locc = variant[0:4]
+    N = numpy.broadcast(numpy.asarray(ryangles), numpy.asarray(rzangles)).size
+    costs = simulation_costs(variant, N, shots, properties, max_bond, memory)
+    if (method == 'auto'):
+        method = choose_simulation_method(variant, N, shots, properties, max_bond, memory)[0]
+    elif (method not in costs):
+        raise ValueError("method '{}' does not apply to {} (applicable: {})".format(method, 'counts' if shots else 'clone states', ', '.join(costs) or 'none'))
+    if log is not None:
+        log("simulate_sweep: {} m={} ancilla={} {} {}, {} message states{}: {} (predicted {:.3g}s; {})".format(
+            variant_metadata(variant)['name'], m, ancilla, topology, locc, N, '' if shots is None else ', {} shots'.format(shots),
+            method, costs[method], ', '.join('{} {:.3g}s'.format(name, cost) for name, cost in sorted(costs.items(), key=lambda item: item[1]) if name != method) or 'no alternatives'))
+    if (properties is not None and initial_layout is None):
+        initial_layout = [*range(variant_metadata(variant)['width'])]
+    if (method == 'symmetric'):
+        rhos, fidelities, probabilities = symmetric_clone_states(m, ryangles, rzangles, ancilla, locc, topology=topology)
+        return (numpy.repeat(rhos[:, None], m, axis=1), numpy.repeat(fidelities[:, None], m, axis=1), probabilities), method
+    if (method == 'exact'):
+        return exact_clone_states(variant, ryangles, rzangles), method
+    if (method == 'mps'):
+        return mps_clone_states(variant, ryangles, rzangles, max_bond)[0:3], method
+    if (method == 'noisy'):
+        return noisy_clone_states(variant, properties, ryangles, rzangles, initial_layout), method
+    if (method == 'emulate'):
+        return emulate_tomography_counts(variant, ryangles, rzangles, shots, seed), method
+    if (method == 'shared_prefix'):
+        return shared_prefix_tomography_sweep(variant, ryangles, rzangles, shots, seed), method
+    backend = Aer.get_backend('qasm_simulator') if backend is None else backend
+    options = {'method': method[len('aer_'):]}
+    if (seed is not None):
+        options['seed_simulator'] = seed
+    if (method == 'aer_matrix_product_state' and max_bond is not None):
+        options['matrix_product_state_max_bond_dimension'] = max_bond
+    transpile_options = None
+    if (properties is not None):
+        noise_model = NoiseModel.from_backend_properties(properties)
+        options['noise_model'] = noise_model
+        transpile_options = {'coupling_map': calibration_coupling_map(properties), 'initial_layout': initial_layout,
+                             'basis_gates': noise_model.basis_gates, 'optimization_level': 3}
+    return run_tomography_sweep(backend, variant, ryangles, rzangles, shots, transpile_options=transpile_options, **options), method
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='message angle sweep of a telecloning variant with the cheapest simulation method')
+    parser.add_argument('variant', help='variant name, e.g. deferred_measurement_PCC or PCC_postselect_00')
+    parser.add_argument('--angles', type=int, default=17, help='message angle slices (ry in [0,pi], rz in [0,2pi])')
+    parser.add_argument('--shots', type=int, default=None, help='tomography counts with this many shots (default: exact clone states)')
+    parser.add_argument('--calibration', default=None, help='calibration snapshot (json) for a device noise model, see save_calibration')
+    parser.add_argument('--layout', type=int, nargs='+', default=None, help='physical qubits of the variant qubits')
+    parser.add_argument('--method', default='auto', choices=('auto',) + STATE_METHODS + COUNT_METHODS)
+    parser.add_argument('--max-bond', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    ryangles = numpy.linspace(0, math.pi, num=args.angles)[:, None]
+    rzangles = numpy.linspace(0, 2*math.pi, num=args.angles)[None, :]
+    properties = None if args.calibration is None else load_calibration(args.calibration)
+    t0 = time.time()
+    results, method = simulate_sweep(args.variant, ryangles, rzangles, args.shots, properties, args.layout, args.method, args.seed, args.max_bond)
+    if (args.shots is None):
+        fidelities = results[1]
+        print("clone fidelity mean {:.4f} min {:.4f} max {:.4f}".format(fidelities.mean(), fidelities.min(), fidelities.max()))
+    print("{} message states with {} in {:.2f}s".format(args.angles**2, method, time.time()-t0))
@@ -0,0 +1,161 @@
+"""
+© 2022. Triad National Security, LLC. All rights reserved.
+This program was produced under U.S. Government contract 89233218CNA000001 for Los Alamos
+National Laboratory (LANL), which is operated by Triad National Security, LLC for the U.S.
+Department of Energy/National Nuclear Security Administration. All rights in the program are
+reserved by Triad National Security, LLC, and the U.S. Department of Energy/National Nuclear
+Security Administration. The Government is granted for itself and others acting on its behalf a
+nonexclusive, paid-up, irrevocable worldwide license in this material to reproduce, prepare
+derivative works, distribute copies to the public, perform publicly and display publicly, and to permit
+others to do so.
+"""
+
+from create_telecloning_circuits import *
+from scipy.optimize import least_squares
+from math import comb
+import itertools
+import argparse
+
+''' Offline synthesis of ancilla-free telecloning states P C^m
+    Target: port (qubit 0) + m clones in a state sum_{p,l} c_{p,l} |p⟩|D^m_l⟩ that teleclones every message with the
+    optimal universal fidelity (2m+1)/(3m), as checked by verify_TCstate. Such states exist beyond m=3, e.g. with
+    clone Hamming weights only in {m-k, .., m} for small k (k=2 up to m=7).
+    Circuit ansatz, on the port and the k clones next to it:
+    - X on the clones k+1..m, a prefix of CX gates along the coupling graph, each followed by RY on both qubits
+      (plus RY on all prefix qubits in front), then DSU(m, min_weight=m-k) on the clones in reversed order
+    - the prefix prepares the thermometer states of the DSU input, the truncated DSU needs O(mk) instead of O(m^2) CX
+    search_TCstate
+    - searches prefixes of increasing k and CX count within the CX budget (all CX orders if few, random ones otherwise)
+    - fits the angles by least squares on the clone fidelity deviations, evaluated on the Dicke coefficients
+    - returns the first circuit passing verify_TCstate (as TCcircuit) and its table entry, (None, None) if none is found
+    save_TCstate
+    - writes the entry into the lookup table read by TCstate, see TCstate_from_table
+    usage: python synthesize_TCstate.py 4 5 6 7 --topology LNN
+'''
+def search_TCstate(m, topology='LNN', cx_budget=None, max_k=None, max_prefix_cx=None, max_structures=2000, restarts=3, seed=0, tol=1e-9):
+    rng = numpy.random.default_rng(seed)
+    clone_operators = _clone_operators(m)
+    messages = message_statevectors(*icosahedron_messages())
+    for k in range(1, m+1 if max_k is None else max_k+1):
+        DSU_cx = DSU(m, IR=True, min_weight=m-k).count_ops().get('cx', 0)
+        if (cx_budget is not None and DSU_cx + 1 > cx_budget):
+            break
+        edges = [(i, i+1) for i in range(k)] if (topology in LNN_TOPOLOGIES) else [*itertools.combinations(range(k+1), 2)]
+        directed = edges + [(b, a) for a, b in edges]
+        for length in range(1, (2**(k+1) if max_prefix_cx is None else max_prefix_cx)+1):
+            if (cx_budget is not None and DSU_cx + length > cx_budget):
+                break
+            if (len(directed)**length <= max_structures):
+                structures = itertools.product(directed, repeat=length)
+            else:
+                structures = ([directed[i] for i in rng.integers(len(directed), size=length)] for _ in range(max_structures))
+            for structure in structures:
+                for _ in range(restarts):
+                    residuals = lambda angles: _prefix_residuals(m, k, structure, angles, clone_operators, messages)
+                    fit = least_squares(residuals, rng.uniform(-numpy.pi, numpy.pi, k+1+2*length), xtol=1e-15, ftol=1e-15, gtol=1e-15, max_nfev=50*(k+1+2*length))
+                    if (numpy.abs(fit.fun).max() < tol):
+                        qc = prefix_circuit(m, k, structure, fit.x)
+                        deviation = verify_TCstate(m, qc)
+                        if (deviation < 1e-7):
+                            return qc, {'m': m, 'topology': topology, 'k': k, 'num_qubits': m+1, 'cx': qc.count_ops().get('cx', 0),
+                                        'deviation': deviation, 'gates': [[op, [*q]] + ([] if p is None else [p]) for op, q, _, p, _ in qc]}
+    return None, None
+
+''' prefix_circuit
+    the TCstate circuit of search_TCstate for a prefix structure (list of CX (control, target) on qubits 0..k) and its angles
+'''
+def prefix_circuit(m, k, structure, angles):
+    angles = numpy.mod(numpy.asarray(angles) + numpy.pi, 2*numpy.pi) - numpy.pi # RY(θ+2π) = -RY(θ)
+    qc = TCcircuit(m+1, qreg='qTCstate')
+    for q in range(k+1, m+1):
+        qc.x(q)
+    for q in range(k+1):
+        if (abs(angles[q]) > 1e-12): qc.ry(angles[q], q)
+    for i, (control, target) in enumerate(structure):
+        qc.cx(control, target)
+        if (abs(angles[k+1+2*i]) > 1e-12): qc.ry(angles[k+1+2*i], control)
+        if (abs(angles[k+2+2*i]) > 1e-12): qc.ry(angles[k+2+2*i], target)
+    qc.compose(DSU(m, IR=True, min_weight=m-k), qubits=[*range(m,0,-1)], inplace=True)
+    return qc
+
+''' save_TCstate
+    stores a search_TCstate entry in the lookup table (json), replacing an entry for the same m and topology only if it
+    uses fewer CX gates (or overwrite=True)
+'''
+def save_TCstate(entry, path=TCSTATE_TABLE, overwrite=False):
+    table = dict(TCstate_table(path))
+    key = '{},{}'.format(entry['m'], 'LNN' if (entry['topology'] in LNN_TOPOLOGIES) else entry['topology'])
+    if (overwrite or key not in table or entry['cx'] < table[key]['cx']):
+        table[key] = {name: entry[name] for name in ['num_qubits', 'cx', 'k', 'deviation', 'gates']}
+        with open(path, 'w') as file:
+            json.dump(table, file, indent=1, sort_keys=True)
+        TCstate_table_clear()
+    return table[key]
+
+# single clone reduced operators Tr_{other clones} |D^m_l⟩⟨D^m_j|, indexed [l, j, a, b]
+def _clone_operators(m):
+    R = numpy.zeros((m+1, m+1, 2, 2))
+    for l, a, b in itertools.product(range(m+1), range(2), range(2)):
+        j = l-a+b
+        if (0 <= l-a <= m-1 and 0 <= j <= m):
+            R[l, j, a, b] = numpy.sqrt(comb(m-1, l-a)/comb(m, l) * comb(m-1, j-b)/comb(m, j))
+    return R
+
+# clone fidelities of all messages, for the state sum_{p,l} c_{p,l}|p⟩|D^m_l⟩ and LOCC(locc='dfm'):
+# the Pauli corrections twirl the state, i.e. F(ψ) = 1/2 sum_P g(Pψ) with g(φ) = ⟨φ|Tr(|Vφ⟩⟨Vφ|)|φ⟩, V|p⟩ = sum_l c_{p,l}|D^m_l⟩
+_PAULIS = numpy.array([[[1,0],[0,1]], [[0,1],[1,0]], [[0,-1j],[1j,0]], [[1,0],[0,-1]]])
+def _clone_fidelities(c, clone_operators, messages):
+    phis = numpy.einsum('kab,nb->nka', _PAULIS, messages)
+    amplitudes = numpy.einsum('nkp,pl->nkl', phis, c)
+    g = numpy.einsum('nkl,nkj,nka,ljab,nkb->nk', amplitudes, amplitudes.conj(), phis.conj(), clone_operators, phis)
+    return 0.5*numpy.real(g.sum(axis=1))
+
+# fidelity deviations and amplitudes outside the DSU inputs of the prefix state on port + clones 1..k,
+# where clones 1..z are |0⟩ and clones z+1..k (and beyond) are |1⟩ for clone Hamming weight m-z
+def _prefix_residuals(m, k, structure, angles, clone_operators, messages):
+    state = _prefix_statevector(k+1, structure, angles)
+    inputs = [sum(2**q for q in range(z+1, k+1)) for z in range(k+1)]
+    c = numpy.zeros((2, m+1))
+    for z, index in enumerate(inputs):
+        c[:, m-z] = state[[index, index+1]]
+    leakage = numpy.delete(state, inputs + [index+1 for index in inputs])
+    return numpy.concatenate([_clone_fidelities(c, clone_operators, messages) - (2*m+1)/(3*m), leakage])
+
+def _prefix_statevector(n, structure, angles):
+    state = numpy.zeros(2**n)
+    state[0] = 1
+    tensor = state.reshape((2,)*n) # axis n-1-q is qubit q
+    for q in range(n):
+        tensor = _ry(tensor, n-1-q, angles[q])
+    for i, (control, target) in enumerate(structure):
+        tensor = _cx(tensor, n-1-control, n-1-target)
+        tensor = _ry(tensor, n-1-control, angles[n+2*i])
+        tensor = _ry(tensor, n-1-target, angles[n+1+2*i])
+    return tensor.reshape(-1)
+def _ry(tensor, axis, theta):
+    c, s = numpy.cos(theta/2), numpy.sin(theta/2)
+    return numpy.moveaxis(numpy.tensordot(numpy.array([[c, -s], [s, c]]), tensor, axes=([1], [axis])), 0, axis)
+def _cx(tensor, control_axis, target_axis):
+    tensor = tensor.copy()
+    index = [slice(None)]*tensor.ndim
+    index[control_axis] = 1
+    tensor[tuple(index)] = numpy.flip(tensor[tuple(index)], axis=target_axis - (target_axis > control_axis))
+    return tensor
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='search ancilla-free telecloning state circuits and store them in the TCstate lookup table')
+    parser.add_argument('m', type=int, nargs='+', help='numbers of clones')
+    parser.add_argument('--topology', default='LNN', help="'LNN' (also used for 'heavyhex') or 'full'")
+    parser.add_argument('--cx-budget', type=int, default=None, help='maximal number of CX gates')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--table', default=TCSTATE_TABLE)
+    args = parser.parse_args()
+    for m in args.m:
+        t0 = time.time()
+        qc, entry = search_TCstate(m, args.topology, args.cx_budget, seed=args.seed)
+        if entry is None:
+            print("m={}: no circuit found within the CX budget".format(m))
+            continue
+        stored = save_TCstate(entry, args.table)
+        print("m={}: k={}, {} CX, deviation {:.1e}, {:.1f}s, table entry has {} CX".format(m, entry['k'], entry['cx'], entry['deviation'], time.time()-t0, stored['cx']))
@@ -13,7 +13,7 @@ others to do so.
 from qiskit import QuantumCircuit, transpile
 import copy
 import re
-from qiskit.ignis.mitigation.measurement import complete_meas_cal
+from qiskit.ignis.mitigation.measurement import complete_meas_cal, tensored_meas_cal
 from qiskit.ignis.verification import marginal_counts
 import seaborn as sns
 import matplotlib.pyplot as plt
@@ -104,6 +104,17 @@ def generate_transpiled_measurement_error_mitigation_circuits(qubits_to_measure,
 	meas_calibs, state_labels = complete_meas_cal(qubit_list=[i for i in range(len(qubits_to_measure))], circlabel='mcal')
 	transpiled = transpile(copy.deepcopy(meas_calibs), coupling_map=coupling_map, optimization_level=0, basis_gates=["x", "sx", "cx", "rz"], initial_layout=qubits_to_measure)
 	return transpiled
+def generate_transpiled_tensored_measurement_error_mitigation_circuits(qubits_to_measure, copies, coupling_map):
+	"""
+	tensored calibration of packed circuits, one block per copy (qubits_to_measure split evenly in order), i.e.
+	2^(measured qubits of one copy) circuits instead of 2^(all measured qubits); fit with TensoredMeasFitter(mit_pattern)
+	"""
+	assert type(qubits_to_measure) is list and len(qubits_to_measure) % copies == 0
+	n = len(qubits_to_measure)//copies
+	mit_pattern = [[k*n+i for i in range(n)] for k in range(copies)]
+	meas_calibs, mit_pattern = tensored_meas_cal(mit_pattern=mit_pattern, circlabel='mcal')
+	transpiled = transpile(copy.deepcopy(meas_calibs), coupling_map=coupling_map, optimization_level=0, basis_gates=["x", "sx", "cx", "rz"], initial_layout=qubits_to_measure)
+	return transpiled, mit_pattern
 def add_measurements_for_postselect_circuits(qc, post_select_indices):
 	qc.barrier()
 	for i in list(post_select_indices.keys()):
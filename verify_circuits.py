@@ -0,0 +1,97 @@
+"""
+© 2022. Triad National Security, LLC. All rights reserved.
+This program was produced under U.S. Government contract 89233218CNA000001 for Los Alamos
+National Laboratory (LANL), which is operated by Triad National Security, LLC for the U.S.
+Department of Energy/National Nuclear Security Administration. All rights in the program are
+reserved by Triad National Security, LLC, and the U.S. Department of Energy/National Nuclear
+Security Administration. The Government is granted for itself and others acting on its behalf a
+nonexclusive, paid-up, irrevocable worldwide license in this material to reproduce, prepare
+derivative works, distribute copies to the public, perform publicly and display publicly, and to permit
+others to do so.
+"""
+
+from create_telecloning_circuits import *
+import argparse
+import sys
+
+''' Regression suite of circuit equivalences, see the equivalence checks in create_telecloning_circuits
+    equivalence_checks(m)
+    - (name, deviation function) pairs for m clones, every deviation must be below the tolerance:
+      DSU against Dicke states (also truncated, min_weight), DSU against DSU_old, the log_depth tree 'dfm' LOCC
+      against the linear one (also for m < LOG_DEPTH_MIN_M, where LOCC keeps the linear stage),
+      the parameterized circuit template through to_arrays / from_arrays (same digest, same bound state),
+      the closed-form circuit_cost (gate counts, depth) against the built templates,
+      all TCstate variants (topology, anc_opt) against the closed form TCstate_statevector, with and
+      without ancillas (the latter only if the lookup table has a circuit), and for m <= 6 the symmetric-subspace clone
+      states against the gate-level ones (exact_clone_states) of all LOCC variants
+    run_checks(ms, tol)
+    - runs all checks, prints one line per check and returns the names of the failed ones
+    usage: python verify_circuits.py 2 3 4 5 6 7 8 9   (exit code 1 if a check fails)
+'''
+def equivalence_checks(m):
+    checks = [('DSU', lambda: verify_DSU(m)),
+              ('DSU min_weight={}'.format(m//2), lambda: verify_DSU(m, min_weight=m//2)),
+              ('DSU vs DSU_old', lambda: verify_equivalent(DSU(m, IR=True), DSU_old(m))),
+              ('LOCC dfm log_depth', lambda: verify_equivalent(dfm_full(TCcircuit(2*m+1), LOCC_qubit_positions(m), True), dfm_full(TCcircuit(2*m+1), LOCC_qubit_positions(m)))),
+              ('TCstate ancilla', lambda: verify_TCstate_equivalent(m, True)),
+              ('template arrays', lambda: verify_template_arrays(m)),
+              ('circuit_cost', lambda: verify_circuit_cost(m))]
+    if (m <= 3 or TCstate_from_table(m) is not None):
+        checks.append(('TCstate no ancilla', lambda: verify_TCstate_equivalent(m, False)))
+    if (m <= 6):
+        checks.append(('symmetric clone states', lambda: verify_symmetric_clone_states(m)))
+    return checks
+
+def verify_symmetric_clone_states(m, loccs=('dfm', 'locc', 'ps00', 'ps11')):
+    ryangles, rzangles = icosahedron_messages()
+    deviation = 0
+    for locc in loccs:
+        rhos, _, probabilities = exact_clone_states(TCvariant(m, True, 'LNN', locc), ryangles, rzangles)
+        symmetric_rhos, _, symmetric_probabilities = symmetric_clone_states(m, ryangles, rzangles, True, locc)
+        deviation = max(deviation, numpy.abs(rhos - symmetric_rhos[:, None]).max(), numpy.abs(probabilities - symmetric_probabilities).max())
+    return deviation
+
+def verify_template_arrays(m, angles=(1.1, 0.7)):
+    qc, _, parameters = cached_circuit_template(m, True, 'LNN', 'dfm', True, False, True)
+    roundtrip = TCcircuit.from_arrays(qc.to_arrays(), parameters={p.name: p for p in parameters})
+    if (roundtrip.digest() != qc.digest() or roundtrip.digest() == qc.assign_parameters(dict(zip(parameters, angles))).digest()):
+        return 1.0
+    values = dict(zip(parameters, angles))
+    return numpy.abs(roundtrip.assign_parameters(values).evolve() - qc.assign_parameters(values).evolve()).max()
+
+def verify_circuit_cost(m, loccs=('dfm', 'locc', 'ps01')):
+    deviation = 0
+    for ancilla in ([True, False] if (m <= 3 or TCstate_from_table(m) is not None) else [True]):
+        for topology in ['LNN', 'full']:
+            for locc in loccs:
+                for anc_opt in ([False, True] if ancilla else [False]):
+                    for log_depth in ([False, True] if (topology == 'full' and locc == 'dfm') else [False]):
+                        cost = circuit_cost(m, ancilla, topology, locc, anc_opt, log_depth)
+                        qc = cached_circuit_template(m, ancilla, topology, locc, True, anc_opt, True, log_depth)[0]
+                        counts = qc.count_ops()
+                        built = {'cx': counts.get('cx', 0), 'measure': counts.get('measure', 0), 'depth': qc.depth(),
+                                 'single_qubit': sum(counts.values()) - sum(counts.get(name, 0) for name in ['cx', 'measure', 'barrier'])}
+                        deviation = max(deviation, *(abs(cost[key] - built[key]) for key in built))
+    return deviation
+
+def run_checks(ms, tol=1e-9):
+    failed = []
+    for m in ms:
+        for name, check in equivalence_checks(m):
+            t0 = time.time()
+            deviation = check()
+            status = 'ok' if deviation < tol else 'FAILED'
+            print("m={} {:<24} deviation {:.1e} {:6.2f}s {}".format(m, name, deviation, time.time()-t0, status))
+            if (deviation >= tol):
+                failed.append((m, name))
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='equivalence checks of the telecloning circuit variants')
+    parser.add_argument('m', type=int, nargs='*', default=[*range(2, 10)], help='numbers of clones (default 2..9)')
+    parser.add_argument('--tol', type=float, default=1e-9)
+    args = parser.parse_args()
+    failed = run_checks(args.m, args.tol)
+    print("{} failed".format(len(failed)) if failed else "all checks passed")
+    sys.exit(1 if failed else 0)